@@ -0,0 +1,348 @@
+"""
+Benchmarks for the gjirafa50 API.
+
+Starts a local stand-in for gjirafa50.com that serves the recorded pages in
+fixtures/, runs the API against it in a separate process and reports the
+throughput and p50/p99 latency of each endpoint. Then runs micro-benchmarks of
+the parsers in this process.
+
+    python benchmark.py
+    python benchmark.py --requests 500 --concurrency 20 --endpoints search,product_details
+    python benchmark.py --micro-only
+    python benchmark.py --no-cache --parser html.parser --parse-executor process
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+BENCHMARK_API_KEY = "benchmark"
+BENCHMARK_METRICS_TOKEN = "benchmark"
+
+# Paths of the stand-in gjirafa50.com and the fixture each one serves
+UPSTREAM_ROUTES = {
+    "/product/search": ("search.json", "application/json; charset=utf-8"),
+    "/": ("homepage.html", "text/html; charset=utf-8"),
+    "/happy-hours": ("happy_hours.html", "text/html; charset=utf-8"),
+}
+# Every other path is a product page
+UPSTREAM_PRODUCT_PAGE = ("product.html", "text/html; charset=utf-8")
+
+# Endpoint name -> function building (method, path, query params, JSON body) for the i-th request.
+# URLs and queries vary with i where the API would otherwise answer from its cache or coalesce requests.
+ENDPOINTS: Dict[str, Callable[[int], Tuple[str, str, Optional[dict], Optional[dict]]]] = {
+    "search": lambda i: ("GET", "/api/search", {"pagenumber": 1, "orderby": "10", "q": f"laptop {i}"}, None),
+    "search_cached": lambda i: ("GET", "/api/search", {"pagenumber": 1, "orderby": "10", "q": "laptop"}, None),
+    "search_filled": lambda i: ("GET", "/api/search", {"pagenumber": 1, "orderby": "10", "q": f"monitor {i}",
+                                                      "startprice": 100, "maxprice": 1500, "page_size": 24}, None),
+    "search_all": lambda i: ("GET", "/api/search/all", {"orderby": "10", "q": f"tablet {i}", "max_pages": 12}, None),
+    "product_details": lambda i: ("GET", "/api/product/details", {"product_url": f"https://gjirafa50.com/produkt-{i}"}, None),
+    "product_details_fields": lambda i: ("GET", "/api/product/details",
+                                         {"product_url": f"https://gjirafa50.com/produkt-{i}", "fields": "Name,Price,InStock"}, None),
+    "product_details_batch": lambda i: ("POST", "/api/product/details/batch", None,
+                                        {"product_urls": [f"https://gjirafa50.com/batch-{i}-{j}" for j in range(10)]}),
+    "categories": lambda i: ("GET", "/api/categories", None, None),
+    "banners": lambda i: ("GET", "/api/banners", None, None),
+    "happy_hours": lambda i: ("GET", "/api/happy-hours", None, None),
+}
+
+
+def read_fixture(name: str) -> bytes:
+    with open(os.path.join(FIXTURES_DIR, name), "rb") as file:
+        return file.read()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+# Stand-in for gjirafa50.com
+
+def fake_gjirafa50_app():
+    fixtures = {path: (read_fixture(name), content_type) for path, (name, content_type) in UPSTREAM_ROUTES.items()}
+    product_page = (read_fixture(UPSTREAM_PRODUCT_PAGE[0]), UPSTREAM_PRODUCT_PAGE[1])
+
+    async def app(scope, receive, send):
+        body, content_type = fixtures.get(scope["path"], product_page)
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
+
+    return app
+
+
+class RedirectTransport(httpx.AsyncBaseTransport):
+    """Sends every request meant for gjirafa50.com to the local stand-in instead."""
+
+    def __init__(self, port: int):
+        self.port = port
+        self.transport = httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        request.url = request.url.copy_with(scheme="http", host="127.0.0.1", port=self.port)
+        return await self.transport.handle_async_request(request)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def serve_upstream(port: int):
+    import uvicorn
+    uvicorn.run(fake_gjirafa50_app(), host="127.0.0.1", port=port, lifespan="off", log_level="warning", access_log=False)
+
+
+def serve_api(port: int, upstream_port: int):
+    import uvicorn
+    import mainapi
+    # The lifespan keeps an existing client, so every upstream request goes to the stand-in
+    mainapi.upstream._client = httpx.AsyncClient(transport=RedirectTransport(upstream_port), timeout=mainapi.upstream.timeout,
+                                                 limits=mainapi.upstream.limits, follow_redirects=True)
+    uvicorn.run(mainapi.app, host="127.0.0.1", port=port, log_level="warning", access_log=False)
+
+
+def configure_environment(args, workdir: str):
+    """Sets the API settings for the benchmark. Must run before mainapi is imported."""
+    keys_file = os.path.join(workdir, "keys.json")
+    with open(keys_file, "w") as file:
+        json.dump({BENCHMARK_API_KEY: {"user": "benchmark", "rate": 0, "daily_quota": 0}}, file)
+    os.environ["API_KEYS_FILE"] = keys_file
+    os.environ["RATE_LIMIT_DB"] = ""
+    os.environ["CATALOG_DB"] = os.path.join(workdir, "catalog.db")
+    os.environ["HISTORY_FILE"] = ""
+    os.environ["AUTH_LOG_SAMPLE_RATE"] = "0"
+    os.environ["METRICS_TOKEN"] = BENCHMARK_METRICS_TOKEN
+    if args.no_cache:
+        os.environ["SEARCH_CACHE_SIZE"] = "0"
+    if args.parser:
+        os.environ["HTML_PARSER"] = args.parser
+    if args.parse_executor:
+        os.environ["PARSE_EXECUTOR"] = args.parse_executor
+
+
+def start_process(command: List[str], log_path: str) -> subprocess.Popen:
+    log = open(log_path, "wb")
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__)] + command, stdout=log, stderr=subprocess.STDOUT,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+def wait_until_ready(url: str, process: subprocess.Popen, log_path: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    with open(log_path) as log:
+        raise RuntimeError(f"{url} did not become ready:\n{log.read()}")
+
+
+# Load tests
+
+async def run_load(client: httpx.AsyncClient, build_request, requests: int, concurrency: int) -> dict:
+    latencies: List[float] = []
+    errors = 0
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index, errors
+        while next_index < requests:
+            index = next_index
+            next_index += 1
+            method, path, params, body = build_request(index)
+            started = time.perf_counter()
+            response = await client.request(method, path, params=params, json=body)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput": requests / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+async def run_load_tests(base_url: str, endpoints: List[str], requests: int, concurrency: int) -> Dict[str, dict]:
+    results = {}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, headers={"api-key": BENCHMARK_API_KEY}, limits=limits, timeout=60) as client:
+        for name in endpoints:
+            build_request = ENDPOINTS[name]
+            # Warm up connections, the parser and the homepage snapshot; offset the indices so warm-up URLs are not reused
+            await run_load(client, lambda i: build_request(requests + i), min(concurrency, requests), concurrency)
+            results[name] = await run_load(client, build_request, requests, concurrency)
+            print_row(name, results[name])
+        metrics = (await client.get("/metrics", headers={"Authorization": f"Bearer {BENCHMARK_METRICS_TOKEN}"})).text
+    print_parse_metrics(metrics)
+    return results
+
+
+def print_row(name: str, result: dict):
+    print(f"{name:<24} {result['throughput']:>10.1f} req/s  p50 {result['p50_ms']:>8.2f} ms  p99 {result['p99_ms']:>8.2f} ms"
+          f"  errors {result['errors']}")
+
+
+def print_parse_metrics(metrics: str):
+    """Prints the mean parse time per parser reported by the API's /metrics endpoint."""
+    sums, counts = {}, {}
+    for line in metrics.splitlines():
+        if line.startswith("gjirafa50_parse_duration_seconds_sum"):
+            sums[line.split('"')[1]] = float(line.rsplit(" ", 1)[1])
+        elif line.startswith("gjirafa50_parse_duration_seconds_count"):
+            counts[line.split('"')[1]] = int(line.rsplit(" ", 1)[1])
+    if counts:
+        print("\nMean parse time reported by /metrics:")
+        for parser, count in counts.items():
+            print(f"  {parser:<32} {sums[parser] / count * 1000:>8.3f} ms  ({count} pages)")
+
+
+# Micro-benchmarks
+
+def time_call(func, number: int, repeat: int = 5) -> float:
+    """Returns the best mean time of one call in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - started) / number)
+    return best
+
+
+def run_micro_benchmarks(number: int) -> Dict[str, float]:
+    import mainapi
+
+    search = read_fixture("search.json")
+    product_html = read_fixture("product.html").decode("utf-8")
+    homepage = read_fixture("homepage.html")
+    happy_hours = read_fixture("happy_hours.html").decode("utf-8")
+
+    async def refresh_homepage_loop():
+        snapshot = mainapi.HomepageSnapshot()
+        for _ in range(number):
+            await snapshot.refresh()
+
+    def time_refresh_homepage() -> float:
+        # Served from memory, so this measures the client and the parsing rather than the network
+        mainapi.upstream._client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200, content=homepage)))
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(refresh_homepage_loop())
+            best = float("inf")
+            for _ in range(5):
+                started = time.perf_counter()
+                loop.run_until_complete(refresh_homepage_loop())
+                best = min(best, (time.perf_counter() - started) / number)
+            loop.run_until_complete(mainapi.upstream.close())
+            return best
+        finally:
+            loop.close()
+
+    parsers = ["html.parser"] + (["lxml"] if mainapi.lxml_html is not None else [])
+    results = {}
+    outputs: Dict[str, list] = {}
+    for parser in parsers:
+        mainapi.HTML_PARSER = parser
+        outputs[parser] = [
+            mainapi.parse_search_page(search),
+            mainapi.extract_delivery_times(mainapi.parse_html(product_html, mainapi.DELIVERY_TIMES_STRAINER)),
+            mainapi.parse_homepage(homepage),
+        ]
+        results[f"parse_search_page [{parser}]"] = time_call(lambda: mainapi.parse_search_page(search), number)
+        results[f"extract_delivery_times [{parser}]"] = time_call(
+            lambda: mainapi.extract_delivery_times(mainapi.parse_html(product_html, mainapi.DELIVERY_TIMES_STRAINER)), number)
+        results[f"HomepageSnapshot.refresh [{parser}]"] = time_refresh_homepage()
+        results[f"parse_homepage [{parser}]"] = time_call(lambda: mainapi.parse_homepage(homepage), number)
+    results["extract_product_models"] = time_call(lambda: mainapi.extract_product_models(product_html), number)
+    results["transform_category_model"] = time_call(
+        lambda: mainapi.transform_category_model(mainapi.find_embedded_json(happy_hours, "categoryModel")), number)
+
+    for name, seconds in results.items():
+        print(f"{name:<40} {seconds * 1000:>9.3f} ms")
+    if len(outputs) > 1:
+        parity = outputs["lxml"] == outputs["html.parser"]
+        print(f"\nlxml and html.parser results {'match' if parity else 'DIFFER'}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint (default 200)")
+    parser.add_argument("--concurrency", type=int, default=10, help="Concurrent requests (default 10)")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="Comma-separated endpoints to load test")
+    parser.add_argument("--number", type=int, default=50, help="Calls per micro-benchmark round (default 50)")
+    parser.add_argument("--micro-only", action="store_true", help="Only run the micro-benchmarks")
+    parser.add_argument("--skip-micro", action="store_true", help="Skip the micro-benchmarks")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the search cache")
+    parser.add_argument("--parser", choices=["lxml", "html.parser"], help="HTML_PARSER for the API")
+    parser.add_argument("--parse-executor", choices=["inline", "process"], help="PARSE_EXECUTOR for the API")
+    parser.add_argument("--json", dest="json_path", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    endpoints = [name.strip() for name in args.endpoints.split(",") if name.strip()]
+    unknown = set(endpoints) - ENDPOINTS.keys()
+    if unknown:
+        parser.error(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        configure_environment(args, workdir)
+        if not args.micro_only:
+            upstream_port, api_port = free_port(), free_port()
+            upstream_log, api_log = os.path.join(workdir, "upstream.log"), os.path.join(workdir, "api.log")
+            processes = [start_process(["serve-upstream", str(upstream_port)], upstream_log)]
+            try:
+                wait_until_ready(f"http://127.0.0.1:{upstream_port}/", processes[0], upstream_log)
+                processes.append(start_process(["serve-api", str(api_port), str(upstream_port)], api_log))
+                wait_until_ready(f"http://127.0.0.1:{api_port}/metrics", processes[1], api_log)
+                print(f"Load test: {args.requests} requests per endpoint, concurrency {args.concurrency}\n")
+                results["endpoints"] = asyncio.run(run_load_tests(f"http://127.0.0.1:{api_port}", endpoints,
+                                                                  args.requests, args.concurrency))
+            finally:
+                for process in processes:
+                    process.terminate()
+                    process.wait()
+        if not args.skip_micro:
+            print(f"\nMicro-benchmarks: best mean of 5 rounds of {args.number} calls\n")
+            results["micro"] = run_micro_benchmarks(args.number)
+
+    if args.json_path:
+        with open(args.json_path, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "serve-upstream":
+        serve_upstream(int(sys.argv[2]))
+    elif len(sys.argv) > 1 and sys.argv[1] == "serve-api":
+        serve_api(int(sys.argv[2]), int(sys.argv[3]))
+    else:
+        main()
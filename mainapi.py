@@ -26,21 +26,1035 @@ SOFTWARE.
 
 
 from fastapi import FastAPI, Query, Header, Depends, HTTPException
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel
 from datetime import datetime
-from bs4 import BeautifulSoup
+from contextlib import asynccontextmanager
+from urllib.parse import urljoin, urlsplit
+from bs4 import BeautifulSoup, SoupStrainer
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+import base64
+import bisect
+import hashlib
+import hmac
 import json
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
+import pickle
+import random
+import sqlite3
+import threading
+import time
+import unicodedata
 import re
-import requests
-from typing import List, Dict, Optional
+import httpx
+from typing import List, Dict, Optional, Tuple
 
-app = FastAPI()
+# Optional faster JSON encoder and brotli compression, used when installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bearer token required by /metrics, which is disabled when it is not set
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+# Bucket upper bounds in seconds of the latency histograms exported at /metrics
+METRICS_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def metrics_label(value) -> str:
+    """Escapes a label value for the Prometheus text format."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Histogram:
+    """
+    Prometheus histogram with one series per value of a single label.
+
+    Observing is a bisect and three additions; buckets are only made cumulative when rendered.
+    """
+
+    def __init__(self, name: str, help: str, label: str, buckets: Tuple[float, ...] = METRICS_LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        # Label value -> [count per bucket..., sum, count]
+        self.series: Dict[str, list] = {}
+
+    def observe(self, label_value: str, value: float):
+        series = self.series.get(label_value)
+        if series is None:
+            series = [0] * len(self.buckets) + [0.0, 0]
+            self.series[label_value] = series
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_value, series in self.series.items():
+            label = f'{self.label}="{metrics_label(label_value)}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {series[-1]}')
+            lines.append(f"{self.name}_sum{{{label}}} {series[-2]}")
+            lines.append(f"{self.name}_count{{{label}}} {series[-1]}")
+        return lines
+
+
+upstream_latency = Histogram("gjirafa50_upstream_request_duration_seconds",
+                             "Time until the response headers of a request to gjirafa50.com arrived.", "host")
+parse_latency = Histogram("gjirafa50_parse_duration_seconds", "Time spent parsing an upstream page.", "parser")
+
+# Upstream HTTP client settings (override through environment variables)
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "15"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100"))
+UPSTREAM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+UPSTREAM_MAX_CONNECTIONS_PER_HOST = int(os.getenv("UPSTREAM_MAX_CONNECTIONS_PER_HOST", "20"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "30"))
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", "2"))
+UPSTREAM_RETRY_BACKOFF = float(os.getenv("UPSTREAM_RETRY_BACKOFF", "0.2"))
+UPSTREAM_RETRY_BACKOFF_MAX = float(os.getenv("UPSTREAM_RETRY_BACKOFF_MAX", "2"))
+UPSTREAM_BREAKER_THRESHOLD = int(os.getenv("UPSTREAM_BREAKER_THRESHOLD", "5"))
+UPSTREAM_BREAKER_RESET_TIMEOUT = float(os.getenv("UPSTREAM_BREAKER_RESET_TIMEOUT", "30"))
+UPSTREAM_HEDGE = os.getenv("UPSTREAM_HEDGE", "false").lower() in ("1", "true", "yes")
+UPSTREAM_HEDGE_MIN_SAMPLES = int(os.getenv("UPSTREAM_HEDGE_MIN_SAMPLES", "20"))
+UPSTREAM_LATENCY_WINDOW = int(os.getenv("UPSTREAM_LATENCY_WINDOW", "200"))
+UPSTREAM_MAX_IN_FLIGHT = int(os.getenv("UPSTREAM_MAX_IN_FLIGHT", "64"))
+
+# Upstream responses that are retried; other status codes are returned to the caller as they are
+UPSTREAM_RETRY_STATUSES = {502, 503, 504}
+
+
+class UpstreamUnavailable(httpx.TransportError):
+    """Raised without contacting gjirafa50.com while the circuit breaker for its host is open."""
+    retry_after = UPSTREAM_BREAKER_RESET_TIMEOUT
+
+
+class UpstreamOverloaded(UpstreamUnavailable):
+    """Raised without contacting gjirafa50.com when too many upstream requests are already in flight."""
+    retry_after = 1
+
+
+class CircuitBreaker:
+    """
+    Tracks consecutive failures of one upstream host.
+
+    After `threshold` consecutive failures the breaker opens and requests are
+    rejected for `reset_timeout` seconds. A single probe request is then let
+    through (half-open): if it succeeds the breaker closes, otherwise it opens again.
+    """
+
+    def __init__(self, threshold: int = UPSTREAM_BREAKER_THRESHOLD, reset_timeout: float = UPSTREAM_BREAKER_RESET_TIMEOUT):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.opened_at is not None or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+    def record_cancelled(self):
+        # A cancelled probe neither closes nor reopens the breaker, the next request probes again
+        self.probing = False
+
+
+class UpstreamClient:
+    """
+    Shared asynchronous HTTP client used for every request to gjirafa50.com.
+
+    Connections are pooled and kept alive between calls, and the number of
+    concurrent requests to a single host is bounded by a per-host semaphore.
+
+    Failed GET requests (connection errors, timeouts and 502/503/504 responses)
+    are retried with jittered exponential backoff. Each host has a circuit
+    breaker, and when hedging is enabled a second request is sent once the
+    first one has taken longer than the host's recent p95 latency.
+
+    At most `max_in_flight` requests are in flight at once, and at most
+    `max_connections_per_host` to a single host; requests beyond either limit
+    are rejected immediately instead of waiting in line for the semaphore.
+    """
+
+    def __init__(self,
+                 timeout: float = UPSTREAM_TIMEOUT,
+                 connect_timeout: float = UPSTREAM_CONNECT_TIMEOUT,
+                 max_connections: int = UPSTREAM_MAX_CONNECTIONS,
+                 max_keepalive_connections: int = UPSTREAM_MAX_KEEPALIVE_CONNECTIONS,
+                 max_connections_per_host: int = UPSTREAM_MAX_CONNECTIONS_PER_HOST,
+                 keepalive_expiry: float = UPSTREAM_KEEPALIVE_EXPIRY,
+                 retries: int = UPSTREAM_RETRIES,
+                 hedge: bool = UPSTREAM_HEDGE,
+                 max_in_flight: int = UPSTREAM_MAX_IN_FLIGHT):
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_keepalive_connections,
+                                   keepalive_expiry=keepalive_expiry)
+        self.max_connections_per_host = max_connections_per_host
+        self.retries = retries
+        self.hedge = hedge
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self._host_in_flight: Dict[str, int] = {}
+        self._client: Optional[httpx.AsyncClient] = None
+        self._host_semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._latencies: Dict[str, deque] = {}
+        self.retried = 0
+        self.hedged = 0
+        self.rejected = 0
+        self.shed = 0
+        self.errors = 0
+
+    async def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits, follow_redirects=True)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        self._host_semaphores.clear()
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            # Lazily create the client when used outside of the app lifespan (e.g. scripts)
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits, follow_redirects=True)
+        return self._client
+
+    def _host_semaphore(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_connections_per_host)
+            self._host_semaphores[host] = semaphore
+        return semaphore
+
+    @staticmethod
+    def _encode_params(params: Optional[dict]) -> Optional[dict]:
+        # Match the query string encoding the site has always received: drop None values, keep "True"/"False"
+        if params is None:
+            return None
+        return {key: str(value) for key, value in params.items() if value is not None}
+
+    def breaker(self, host: str) -> CircuitBreaker:
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            breaker = CircuitBreaker()
+            self._breakers[host] = breaker
+        return breaker
+
+    def p95_latency(self, host: str) -> Optional[float]:
+        """Returns the p95 latency of the recent successful requests to `host`, or None without enough samples."""
+        latencies = self._latencies.get(host)
+        if latencies is None or len(latencies) < UPSTREAM_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(latencies)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    async def _send(self, url: str, params: Optional[dict], stream: bool = False) -> httpx.Response:
+        """Sends a single GET request through the host's circuit breaker."""
+        host = urlsplit(url).netloc
+        breaker = self.breaker(host)
+        if not breaker.allow():
+            self.rejected += 1
+            raise UpstreamUnavailable(f"Circuit breaker open for {host}")
+        started = time.monotonic()
+        try:
+            request = self.client.build_request("GET", url, params=self._encode_params(params))
+            response = await self.client.send(request, stream=stream)
+        except asyncio.CancelledError:
+            breaker.record_cancelled()
+            raise
+        except httpx.TransportError:
+            self.errors += 1
+            breaker.record_failure()
+            raise
+        upstream_latency.observe(host, time.monotonic() - started)
+        if response.status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+            self._latencies.setdefault(host, deque(maxlen=UPSTREAM_LATENCY_WINDOW)).append(time.monotonic() - started)
+        return response
+
+    async def _get_once(self, url: str, params: Optional[dict], stream: bool = False) -> httpx.Response:
+        async with self._host_semaphore(url):
+            return await self._send(url, params, stream=stream)
+
+    async def _get_hedged(self, url: str, params: Optional[dict], stream: bool = False) -> httpx.Response:
+        """
+        Sends a GET request, and a second identical one if the first has not finished within the p95 latency.
+
+        The first successful response wins. The other request is cancelled, or closed if it already has a
+        response, so a streamed loser does not keep its connection.
+        """
+        host = urlsplit(url).netloc
+        delay = self.p95_latency(host)
+        if delay is None:
+            return await self._get_once(url, params, stream)
+        tasks = [asyncio.ensure_future(self._get_once(url, params, stream))]
+        winner = None
+        try:
+            done, pending = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                winner = tasks[0]
+                return winner.result()
+            if self._host_in_flight.get(host, 0) < self.max_connections_per_host:
+                self.hedged += 1
+                tasks.append(asyncio.ensure_future(self._get_hedge(url, params, host, stream)))
+            # Otherwise every slot for the host is taken, so a second request would have to wait in line
+            pending = set(tasks)
+            finished = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    finished = task
+                    if task.exception() is None and task.result().status_code < 500:
+                        winner = task
+                        return task.result()
+            # Every request failed, report the last failure
+            winner = finished
+            return finished.result()
+        finally:
+            for task in tasks:
+                if task is winner:
+                    continue
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled() and task.exception() is None:
+                    await task.result().aclose()
+
+    async def _get_hedge(self, url: str, params: Optional[dict], host: str, stream: bool = False) -> httpx.Response:
+        # The hedged request takes its own slot, so admitted requests never wait on the semaphore
+        self._host_in_flight[host] += 1
+        try:
+            return await self._get_once(url, params, stream)
+        finally:
+            self._host_in_flight[host] -= 1
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter keeps retries from many requests from arriving at the same time
+        return random.uniform(0, min(UPSTREAM_RETRY_BACKOFF_MAX, UPSTREAM_RETRY_BACKOFF * 2 ** attempt))
+
+    async def _with_retries(self, send) -> httpx.Response:
+        for attempt in range(self.retries + 1):
+            try:
+                response = await send()
+            except UpstreamUnavailable:
+                raise
+            except httpx.TransportError:
+                if attempt == self.retries:
+                    raise
+            else:
+                if response.status_code not in UPSTREAM_RETRY_STATUSES or attempt == self.retries:
+                    return response
+                await response.aclose()
+            self.retried += 1
+            await asyncio.sleep(self._backoff(attempt))
+
+    def _admit(self, host: str):
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            self.shed += 1
+            raise UpstreamOverloaded("Too many requests in flight to gjirafa50.com")
+        if self._host_in_flight.get(host, 0) >= self.max_connections_per_host:
+            self.shed += 1
+            raise UpstreamOverloaded(f"Too many requests in flight to {host}")
+        self.in_flight += 1
+        self._host_in_flight[host] = self._host_in_flight.get(host, 0) + 1
+
+    def _release(self, host: str):
+        self.in_flight -= 1
+        self._host_in_flight[host] -= 1
+
+    async def get(self, url: str, params: Optional[dict] = None) -> httpx.Response:
+        """
+        Sends a GET request, retrying failures.
+
+        Raises:
+            UpstreamUnavailable: If the circuit breaker for the host is open.
+            UpstreamOverloaded: If too many requests are already in flight, in total or to the host.
+            httpx.TransportError: If every attempt failed to get a response.
+        """
+        host = urlsplit(url).netloc
+        self._admit(host)
+        try:
+            if self.hedge:
+                return await self._with_retries(lambda: self._get_hedged(url, params))
+            return await self._with_retries(lambda: self._get_once(url, params))
+        finally:
+            self._release(host)
+
+    @asynccontextmanager
+    async def stream(self, url: str, params: Optional[dict] = None):
+        """
+        Sends a GET request and yields the response before its body has been read.
+
+        Sending the request is retried and hedged like get(). Leaving the block early
+        closes the response without downloading the rest of the body.
+        """
+        host = urlsplit(url).netloc
+        self._admit(host)
+        try:
+            if self.hedge:
+                response = await self._with_retries(lambda: self._get_hedged(url, params, stream=True))
+            else:
+                response = await self._with_retries(lambda: self._get_once(url, params, stream=True))
+            try:
+                yield response
+            finally:
+                await response.aclose()
+        finally:
+            self._release(host)
+
+    def stats(self) -> dict:
+        return {
+            "retried": self.retried,
+            "hedged": self.hedged,
+            "rejected": self.rejected,
+            "in_flight": self.in_flight,
+            "shed": self.shed,
+            "errors": self.errors,
+            "hosts": {
+                host: {
+                    "breaker": breaker.state,
+                    "consecutive_failures": breaker.failures,
+                    "p95_latency": self.p95_latency(host),
+                }
+                for host, breaker in self._breakers.items()
+            },
+        }
+
+
+upstream = UpstreamClient()
+
+
+# Product details batch settings
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+BATCH_MAX_URLS = int(os.getenv("BATCH_MAX_URLS", "1000"))
+
+# Homepage snapshot settings (categories and banners)
+HOMEPAGE_REFRESH_INTERVAL = float(os.getenv("HOMEPAGE_REFRESH_INTERVAL", "900"))
+HOMEPAGE_RETRY_INTERVAL = float(os.getenv("HOMEPAGE_RETRY_INTERVAL", "60"))
+
+# Happy hours feed settings
+HAPPY_HOURS_POLL_INTERVAL = float(os.getenv("HAPPY_HOURS_POLL_INTERVAL", "30"))
+HAPPY_HOURS_HEARTBEAT_INTERVAL = float(os.getenv("HAPPY_HOURS_HEARTBEAT_INTERVAL", "15"))
+HAPPY_HOURS_SUBSCRIBER_QUEUE_SIZE = int(os.getenv("HAPPY_HOURS_SUBSCRIBER_QUEUE_SIZE", "16"))
+
+# Multi-page search settings
+SEARCH_ALL_CONCURRENCY = int(os.getenv("SEARCH_ALL_CONCURRENCY", "4"))
+SEARCH_ALL_MAX_PAGES = int(os.getenv("SEARCH_ALL_MAX_PAGES", "50"))
+
+# Filled-page search settings
+SEARCH_MAX_PAGE_SIZE = int(os.getenv("SEARCH_MAX_PAGE_SIZE", "100"))
+SEARCH_FILL_MAX_PAGES = int(os.getenv("SEARCH_FILL_MAX_PAGES", "10"))
+
+# Search response cache settings
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "1024"))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "300"))
+SEARCH_CACHE_STALE_TTL = float(os.getenv("SEARCH_CACHE_STALE_TTL", "600"))
+
+
+class TTLCache:
+    """
+    Bounded LRU cache whose entries expire after a time-to-live.
+
+    Entries older than `ttl` are still returned as stale for another `stale_ttl`
+    seconds, so callers can serve them while a refresh runs in the background.
+    Expired entries are kept until they are evicted, so `peek` can still serve
+    them when gjirafa50.com is unavailable.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, stale_ttl: float = 0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries: "OrderedDict[object, tuple]" = OrderedDict()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Returns a (value, is_stale) tuple, or None if the key is missing or expired."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, stored_at = entry
+            age = time.monotonic() - stored_at
+            if age <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value, False
+            if age <= self.ttl + self.stale_ttl:
+                self._entries.move_to_end(key)
+                self.stale_hits += 1
+                return value, True
+        self.misses += 1
+        return None
+
+    def peek(self, key):
+        """Returns the value stored for `key` regardless of its age, or None."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self.stale_hits += 1
+        return entry[0]
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        self._entries[key] = (value, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+        }
+
+
+# Keys currently being refreshed in the background, per cache
+_refreshing: Dict[int, set] = {}
+# Keep references to background tasks so they are not garbage collected while running
+_background_tasks: set = set()
+
+def spawn_background(coro):
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+async def cached_call(cache: TTLCache, key, fetch):
+    """
+    Returns the cached value for `key`, calling `fetch()` on a miss.
+
+    Stale entries are returned immediately and refreshed in the background.
+    Results that are None are not cached. When the upstream cannot be reached
+    or its circuit breaker is open, expired entries are returned instead of failing.
+    """
+    cached = cache.get(key)
+    if cached is not None:
+        value, is_stale = cached
+        if is_stale:
+            refreshing = _refreshing.setdefault(id(cache), set())
+            if key not in refreshing:
+                refreshing.add(key)
+                spawn_background(_refresh(cache, key, fetch, refreshing))
+        return value
+    try:
+        value = await fetch()
+    except httpx.TransportError:
+        value = cache.peek(key)
+        if value is None:
+            raise
+        return value
+    if value is not None:
+        cache.set(key, value)
+    return value
+
+async def _refresh(cache: TTLCache, key, fetch, refreshing: set):
+    try:
+        value = await fetch()
+        if value is not None:
+            cache.set(key, value)
+    except Exception as e:
+        print(f"Background refresh failed: {str(e)}")
+    finally:
+        refreshing.discard(key)
+
+
+search_cache = TTLCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL, SEARCH_CACHE_STALE_TTL)
+
+# Caches reported by /api/cache/stats
+caches: Dict[str, TTLCache] = {"search": search_cache}
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls into a single in-flight call.
+
+    The first caller for a key starts the call, and every caller that arrives
+    while it is running waits for and shares the same result (or exception).
+    """
+
+    def __init__(self):
+        self._calls: Dict[object, asyncio.Task] = {}
+        self.coalesced = 0
+
+    async def do(self, key, fetch):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fetch())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.coalesced += 1
+        # Shield the shared call so one disconnecting client does not cancel it for the others
+        return await asyncio.shield(task)
+
+    def _done(self, key, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved in case every waiter went away
+            task.exception()
+
+
+flights = SingleFlight()
+
+
+# HTML parser backend: lxml when it is installed, the built-in html.parser otherwise
+try:
+    from lxml import etree as lxml_etree, html as lxml_html
+    DEFAULT_HTML_PARSER = "lxml"
+except ImportError:
+    lxml_etree = lxml_html = None
+    DEFAULT_HTML_PARSER = "html.parser"
+HTML_PARSER = os.getenv("HTML_PARSER", DEFAULT_HTML_PARSER)
+
+def _class_xpath(tag: str, class_name: str) -> str:
+    # First descendant with the class, matching BeautifulSoup's find(tag, class_=class_name)
+    return f"descendant::{tag}[contains(concat(' ', normalize-space(@class), ' '), ' {class_name} ')][1]"
+
+if lxml_etree is not None:
+    SEARCH_XPATHS = {
+        "item_box": lxml_etree.XPath("//div[contains(concat(' ', normalize-space(@class), ' '), ' item-box ')]"),
+        "title": lxml_etree.XPath(_class_xpath("h2", "product-title")),
+        "price": lxml_etree.XPath(_class_xpath("span", "price")),
+        "discount": lxml_etree.XPath(_class_xpath("div", "discount__label")),
+        "link": lxml_etree.XPath("descendant::a[1]"),
+        "image": lxml_etree.XPath("descendant::img[1]"),
+    }
+
+def _class_value(value) -> str:
+    # Strainers see the class attribute before it is split into a list of classes
+    return value if isinstance(value, str) else " ".join(value or ())
+
+def _has_class(class_name: str):
+    """Strainer attribute matcher equivalent to find(..., class_=class_name)."""
+    return lambda value: class_name in _class_value(value).split()
+
+# Strainers restricting parsing to the subtrees each scraper reads
+SEARCH_RESULTS_STRAINER = SoupStrainer("div", class_=_has_class("item-box"))
+HOMEPAGE_STRAINER = SoupStrainer(["li", "div"], class_=lambda value: bool({"category-item", "swiper-slide"} & set(_class_value(value).split())))
+DELIVERY_TIMES_CLASSES = {
+    "Prishtinë": "flex flex-col justify-center pl-2 text-xs font-medium pr-2 mr-2 tablet:border-r",
+    "tjera": "flex flex-col justify-center pl-2 text-xs font-medium",
+}
+DELIVERY_TIMES_STRAINER = SoupStrainer("div", class_=lambda value: _class_value(value) in DELIVERY_TIMES_CLASSES.values())
+
+def parse_html(markup, parse_only: Optional[SoupStrainer] = None, parser: Optional[str] = None) -> BeautifulSoup:
+    """
+    Parses HTML with the configured parser backend.
+
+    When `parse_only` is given only the matching elements and their subtrees are built,
+    which skips most of the document.
+    """
+    return BeautifulSoup(markup, parser or HTML_PARSER, parse_only=parse_only)
+
+
+# Parse executor settings: "inline" parses on the event loop, "process" offloads parsing to a process pool
+PARSE_EXECUTOR = os.getenv("PARSE_EXECUTOR", "inline")
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "0")) or os.cpu_count() or 1
+
+parse_executor: Optional[ProcessPoolExecutor] = None
+
+def start_parse_executor():
+    global parse_executor
+    if PARSE_EXECUTOR == "process" and parse_executor is None:
+        # Workers import this module fresh instead of inheriting the event loop and open connections
+        parse_executor = ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+def stop_parse_executor():
+    global parse_executor
+    if parse_executor is not None:
+        parse_executor.shutdown(wait=False, cancel_futures=True)
+        parse_executor = None
+
+async def run_parser(func, *args):
+    """
+    Runs a CPU-bound parse function, in the process pool when PARSE_EXECUTOR=process.
+
+    The function and its arguments must be picklable: pass raw page content in and
+    return only the compact extracted result.
+    """
+    started = time.perf_counter()
+    try:
+        if parse_executor is None:
+            return func(*args)
+        return await asyncio.get_running_loop().run_in_executor(parse_executor, func, *args)
+    finally:
+        parse_latency.observe(func.__name__, time.perf_counter() - started)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    api_keys.load()
+    auth_log_listener.start()
+    api_keys_watcher = asyncio.create_task(api_keys.watch())
+    start_parse_executor()
+    await upstream.start()
+    # Categories and banners are loaded in the background so startup does not wait on gjirafa50.com
+    homepage_refresher = asyncio.create_task(homepage.run())
+    happy_hours_poller = asyncio.create_task(happy_hours_feed.run())
+    catalog_crawler_task = asyncio.create_task(catalog_crawler.run()) if CATALOG_CRAWL else None
+    history_saver = None
+    if HISTORY_FILE:
+        if os.path.exists(HISTORY_FILE):
+            price_history.load(HISTORY_FILE)
+        history_saver = asyncio.create_task(price_history.save_periodically(HISTORY_FILE))
+    yield
+    if history_saver is not None:
+        history_saver.cancel()
+        price_history.save(HISTORY_FILE)
+    if catalog_crawler_task is not None:
+        catalog_crawler_task.cancel()
+    homepage_refresher.cancel()
+    happy_hours_poller.cancel()
+    api_keys_watcher.cancel()
+    await upstream.close()
+    stop_parse_executor()
+    catalog.close()
+    rate_limits.close()
+    auth_log_listener.stop()
+
+
+# Response compression settings
+COMPRESSION_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1000"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+
+
+def encode_json(content) -> bytes:
+    """Serializes content to compact UTF-8 JSON, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON response rendered with encode_json.
+
+    Endpoints return it directly with plain dicts, so FastAPI skips its generic
+    jsonable_encoder pass over the content.
+    """
+
+    def render(self, content) -> bytes:
+        return encode_json(content)
+
+
+def make_etag(body: bytes) -> str:
+    # Weak, because the same representation may be sent gzip or brotli compressed
+    return 'W/"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak comparison of an ETag against an If-None-Match header."""
+    if if_none_match.strip() == "*":
+        return True
+    opaque_tag = etag[2:] if etag.startswith("W/") else etag
+    return any((tag.strip()[2:] if tag.strip().startswith("W/") else tag.strip()) == opaque_tag
+               for tag in if_none_match.split(","))
+
+
+class ConditionalRequestMiddleware:
+    """
+    Adds an ETag to complete 200 responses to GET requests and answers a matching
+    If-None-Match with 304 Not Modified. Streaming responses are passed through.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD"):
+            await self.app(scope, receive, send)
+            return
+        if_none_match = Headers(scope=scope).get("if-none-match")
+        start_message = None
+
+        async def send_with_etag(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                # Hold the headers back until the body shows whether the response is complete
+                start_message = message
+                return
+            if start_message is None or message["type"] != "http.response.body":
+                await send(message)
+                return
+            held_message, start_message = start_message, None
+            if message.get("more_body", False):
+                await send(held_message)
+                await send(message)
+                return
+            headers = MutableHeaders(raw=held_message["headers"])
+            etag = headers.get("etag") or make_etag(message.get("body", b""))
+            headers["ETag"] = etag
+            if if_none_match and etag_matches(if_none_match, etag):
+                for header in ("content-length", "content-type", "content-encoding"):
+                    if header in headers:
+                        del headers[header]
+                held_message["status"] = 304
+                message = {"type": "http.response.body", "body": b""}
+            await send(held_message)
+            await send(message)
+
+        await self.app(scope, receive, send_with_etag)
+
+
+class BrotliMiddleware:
+    """
+    Brotli-compresses complete responses for clients that accept it. Streaming
+    responses are left to GZipMiddleware, which runs outside of this middleware.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MINIMUM_SIZE, quality: int = BROTLI_QUALITY):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.quality = quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or "br" not in Headers(scope=scope).get("accept-encoding", ""):
+            await self.app(scope, receive, send)
+            return
+        start_message = None
+
+        async def send_compressed(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                if "content-encoding" in headers or headers.get("content-type", "").startswith("text/event-stream"):
+                    await send(message)
+                else:
+                    start_message = message
+                return
+            if start_message is None or message["type"] != "http.response.body":
+                await send(message)
+                return
+            held_message, start_message = start_message, None
+            body = message.get("body", b"")
+            if not message.get("more_body", False) and len(body) >= self.minimum_size:
+                body = brotli.compress(body, quality=self.quality)
+                headers = MutableHeaders(raw=held_message["headers"])
+                headers["Content-Encoding"] = "br"
+                headers["Content-Length"] = str(len(body))
+                headers.add_vary_header("Accept-Encoding")
+                message = {**message, "body": body}
+            await send(held_message)
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+# Middleware added last runs first: ETags are computed on the uncompressed body, then compressed
+app.add_middleware(ConditionalRequestMiddleware)
+if brotli is not None:
+    app.add_middleware(BrotliMiddleware)
+app.add_middleware(GZipMiddleware, minimum_size=COMPRESSION_MINIMUM_SIZE, compresslevel=GZIP_LEVEL)
+
+@app.exception_handler(UpstreamUnavailable)
+async def upstream_unavailable_handler(request, exc: UpstreamUnavailable):
+    # Reached only when no cached data could be served instead
+    return FastJSONResponse(status_code=503, content={"detail": str(exc)},
+                            headers={"Retry-After": str(int(exc.retry_after))})
+
+@app.exception_handler(httpx.TransportError)
+async def upstream_error_handler(request, exc: httpx.TransportError):
+    # Timeouts and connection errors that outlasted the retries, with no cached data to serve instead
+    return FastJSONResponse(status_code=502, content={"detail": f"Failed to reach gjirafa50.com: {exc!r}"})
+
+# API key store settings
+API_KEYS_FILE = os.getenv("API_KEYS_FILE", "valid_api_keys.json")
+API_KEYS_RELOAD_INTERVAL = float(os.getenv("API_KEYS_RELOAD_INTERVAL", "5"))
+AUTH_LOG_SAMPLE_RATE = float(os.getenv("AUTH_LOG_SAMPLE_RATE", "0.01"))
+
+# Default per-key limits, for keys that do not set their own in the keys file (0 disables a limit)
+RATE_LIMIT_RATE = float(os.getenv("RATE_LIMIT_RATE", "10"))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "20"))
+DAILY_QUOTA = int(os.getenv("DAILY_QUOTA", "0"))
+# SQLite file shared by every worker on the machine, empty keeps the limits per process
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB", "ratelimit.db")
+RATE_LIMIT_DB_TIMEOUT = float(os.getenv("RATE_LIMIT_DB_TIMEOUT", "0.05"))
+
+# Prefix for API keys stored as a SHA-256 hex digest instead of in plain text
+HASHED_KEY_PREFIX = "sha256:"
+
+# Authentication log records are queued and written by a background thread
+auth_log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+auth_logger = logging.getLogger("gjirafa50.auth")
+auth_logger.setLevel(logging.INFO)
+auth_logger.propagate = False
+auth_logger.addHandler(logging.handlers.QueueHandler(auth_log_queue))
+auth_log_listener = logging.handlers.QueueListener(auth_log_queue, logging.StreamHandler())
 
 # Load valid API keys from JSON file
-def load_valid_api_keys():
-    with open("valid_api_keys.json", "r") as file:
+def load_valid_api_keys(path: str = API_KEYS_FILE):
+    with open(path, "r") as file:
         return json.load(file)
 
+def hash_api_key(api_key: str) -> str:
+    """Returns the value to store in the keys file for a hashed API key."""
+    return HASHED_KEY_PREFIX + hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+class APIKey:
+    """
+    A valid API key: the user it belongs to and its limits.
+
+    In the keys file the value of a key is either the user name, which gives
+    the key the default limits, or an object such as
+    {"user": "altin", "rate": 5, "burst": 10, "daily_quota": 10000}.
+    """
+
+    __slots__ = ("id", "user", "rate", "burst", "daily_quota")
+
+    def __init__(self, id: str, user: str, rate: float = RATE_LIMIT_RATE, burst: int = RATE_LIMIT_BURST,
+                 daily_quota: int = DAILY_QUOTA):
+        self.id = id  # SHA-256 hex digest of the key, so plain keys are never written to the limits store
+        self.user = user
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.daily_quota = daily_quota
+
+    @classmethod
+    def from_config(cls, id: str, value) -> "APIKey":
+        if isinstance(value, str):
+            return cls(id, value)
+        if not isinstance(value, dict) or not isinstance(value.get("user"), str):
+            raise ValueError(f"Invalid API key entry: {value!r}")
+        return cls(id, value["user"],
+                   rate=float(cls._limit(value, "rate", RATE_LIMIT_RATE)),
+                   burst=int(cls._limit(value, "burst", RATE_LIMIT_BURST)),
+                   daily_quota=int(cls._limit(value, "daily_quota", DAILY_QUOTA)))
+
+    @staticmethod
+    def _limit(value: dict, name: str, default):
+        # Raised as ValueError so a bad entry keeps the previous keys instead of breaking the reload
+        limit = value.get(name, default)
+        if isinstance(limit, bool) or not isinstance(limit, (int, float)) or not 0 <= limit < float("inf"):
+            raise ValueError(f"Invalid {name} for user {value['user']!r}: {limit!r}")
+        return limit
+
+
+class APIKeyStore:
+    """
+    In-memory registry of valid API keys.
+
+    The keys file is read once and only read again when its modification time
+    changes, so authenticating a request is a dictionary lookup with no I/O.
+    Keys may be stored in plain text or as "sha256:<hex digest>".
+    """
+
+    def __init__(self, path: str = API_KEYS_FILE):
+        self.path = path
+        self.mtime: Optional[float] = None
+        self.plain_keys: Dict[str, APIKey] = {}
+        self.hashed_keys: Dict[str, APIKey] = {}
+
+    def load(self):
+        mtime = os.stat(self.path).st_mtime
+        valid_api_keys = load_valid_api_keys(self.path)
+        if not isinstance(valid_api_keys, dict):
+            raise ValueError("The keys file must contain a JSON object")
+        plain_keys = {}
+        hashed_keys = {}
+        for key, value in valid_api_keys.items():
+            if key.startswith(HASHED_KEY_PREFIX):
+                digest = key[len(HASHED_KEY_PREFIX):].lower()
+                hashed_keys[digest] = APIKey.from_config(digest, value)
+            else:
+                plain_keys[key] = APIKey.from_config(hashlib.sha256(key.encode("utf-8")).hexdigest(), value)
+        # Swap both maps at once so lookups never see a half-loaded registry
+        self.plain_keys, self.hashed_keys = plain_keys, hashed_keys
+        self.mtime = mtime
+
+    def reload_if_changed(self) -> bool:
+        """Reloads the keys file if it changed since the last load. Keeps the old keys if it is invalid."""
+        try:
+            if os.stat(self.path).st_mtime == self.mtime:
+                return False
+            self.load()
+            return True
+        except (OSError, ValueError) as e:
+            auth_logger.error("Failed to reload API keys from %s: %s", self.path, e)
+            return False
+
+    def lookup(self, api_key: str) -> Optional[APIKey]:
+        """Returns the API key entry, or None if the key is not valid."""
+        key = self.plain_keys.get(api_key)
+        if key is None and self.hashed_keys:
+            key = self.hashed_keys.get(hashlib.sha256(api_key.encode("utf-8")).hexdigest())
+        return key
+
+    async def watch(self, interval: float = API_KEYS_RELOAD_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            # Any error is logged and the check repeated, so hot reload never stops for good
+            try:
+                if self.reload_if_changed():
+                    auth_logger.info("Reloaded API keys from %s", self.path)
+            except Exception:
+                auth_logger.exception("Failed to reload API keys from %s", self.path)
+
+
+api_keys = APIKeyStore()
+
 # Model for API key in header
 class APIKeyHeader(BaseModel):
     api_key: str
@@ -51,12 +1065,187 @@ class UnauthorizedAccess(HTTPException):
         super().__init__(status_code=403, detail="Unauthorized access")
 
 # Middleware for API key authentication
-async def authenticate_api_key(api_key: str = Header(...), valid_api_keys: dict = Depends(load_valid_api_keys)):
-    if api_key not in valid_api_keys:
+async def authenticate_api_key(api_key: str = Header(...)):
+    key = api_keys.lookup(api_key)
+    if key is None:
         raise UnauthorizedAccess()
-    else:
-        # You can log the user associated with the API key here if needed
-        print(f"User with API key '{api_key}' is authenticated")
+    # Only a sample of successful authentications is logged to keep the hot path free of I/O
+    if AUTH_LOG_SAMPLE_RATE and random.random() < AUTH_LOG_SAMPLE_RATE:
+        auth_logger.info("User '%s' is authenticated", key.user)
+    return key.user
+
+
+class RateLimitStore:
+    """
+    Token buckets and daily request counters of the API keys.
+
+    The state is kept in SQLite so every uvicorn worker on the machine shares
+    the same limits. Each request is one short transaction on a single row,
+    run in a thread so waiting for another worker's lock never blocks the event loop.
+    """
+
+    def __init__(self, path: str = RATE_LIMIT_DB):
+        self.path = path
+        self._connection: Optional[sqlite3.Connection] = None
+        # Transactions on the shared connection must not interleave between threads
+        self._lock = threading.Lock()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            # Transactions are managed explicitly; a short timeout keeps a locked file from stalling the event loop
+            connection = sqlite3.connect(self.path or ":memory:", timeout=RATE_LIMIT_DB_TIMEOUT,
+                                         isolation_level=None, check_same_thread=False)
+            if self.path:
+                connection.execute("PRAGMA journal_mode=WAL")
+            # Losing the last few updates on a crash only resets some buckets
+            connection.execute("PRAGMA synchronous=OFF")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS buckets (
+                    key TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL,
+                    day TEXT NOT NULL,
+                    used INTEGER NOT NULL
+                )
+            """)
+            self._connection = connection
+        return self._connection
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def take(self, key: APIKey) -> Tuple[bool, float, int, float]:
+        """
+        Takes one request from the key's bucket and daily quota.
+
+        Returns (allowed, tokens left, requests used today, seconds until a request is allowed again).
+        """
+        with self._lock:
+            return self._take(key)
+
+    def _take(self, key: APIKey) -> Tuple[bool, float, int, float]:
+        now = time.time()
+        day = time.strftime("%Y-%m-%d", time.gmtime(now))
+        connection = self.connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT tokens, updated, day, used FROM buckets WHERE key = ?", (key.id,)).fetchone()
+            if row is None:
+                tokens, used = float(key.burst), 0
+            else:
+                tokens = min(float(key.burst), row[0] + (now - row[1]) * key.rate)
+                used = row[3] if row[2] == day else 0
+            if key.daily_quota and used >= key.daily_quota:
+                allowed, retry_after = False, seconds_until_quota_reset(now)
+            elif key.rate and tokens < 1:
+                allowed, retry_after = False, (1 - tokens) / key.rate
+            else:
+                allowed, retry_after = True, 0.0
+                tokens -= 1
+                used += 1
+            connection.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated, day, used) VALUES (?, ?, ?, ?, ?)",
+                               (key.id, tokens, now, day, used))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return allowed, tokens, used, retry_after
+
+
+def seconds_until_quota_reset(now: float) -> float:
+    # Daily quotas reset at midnight UTC
+    return 86400 - now % 86400
+
+
+rate_limits = RateLimitStore()
+
+
+class RateLimitMiddleware:
+    """
+    Applies the token bucket and daily quota of the request's API key.
+
+    Requests over a limit are answered with 429 Too Many Requests and a
+    Retry-After header. Every response to a valid key carries its limit headers
+    and is counted per user and status code for /metrics.
+    Requests without a valid key are passed through, so authentication rejects them.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        api_key = Headers(scope=scope).get("api-key")
+        key = api_keys.lookup(api_key) if api_key else None
+        if key is None:
+            await self.app(scope, receive, send)
+            return
+        headers = {}
+        if key.rate or key.daily_quota:
+            try:
+                allowed, tokens, used, retry_after = await asyncio.to_thread(rate_limits.take, key)
+            except sqlite3.Error as e:
+                # Fail open: an unavailable limits store must not take the API down
+                auth_logger.error("Rate limit store error: %s", e)
+            else:
+                headers = self.limit_headers(key, allowed, tokens, used, retry_after)
+                if not allowed:
+                    detail = "Daily quota exceeded" if key.daily_quota and used >= key.daily_quota else "Rate limit exceeded"
+                    response = FastJSONResponse(status_code=429, content={"detail": detail}, headers=headers)
+                    count_key_request(key.user, 429)
+                    await response(scope, receive, send)
+                    return
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                if headers:
+                    MutableHeaders(scope=message).update(headers)
+                count_key_request(key.user, message["status"])
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+    @staticmethod
+    def limit_headers(key: APIKey, allowed: bool, tokens: float, used: int, retry_after: float) -> dict:
+        headers = {}
+        if key.rate:
+            headers["X-RateLimit-Limit"] = str(key.burst)
+            headers["X-RateLimit-Remaining"] = str(max(int(tokens), 0))
+        if key.daily_quota:
+            headers["X-Quota-Limit"] = str(key.daily_quota)
+            headers["X-Quota-Remaining"] = str(max(key.daily_quota - used, 0))
+            headers["X-Quota-Reset"] = str(int(seconds_until_quota_reset(time.time())))
+        if not allowed:
+            headers["Retry-After"] = str(max(int(retry_after + 0.999), 1))
+        return headers
+
+
+# Requests per (user, status code), exported at /metrics
+key_requests: Dict[Tuple[str, int], int] = {}
+
+def count_key_request(user: str, status: int):
+    key_requests[user, status] = key_requests.get((user, status), 0) + 1
+
+
+# Added last so over-limit requests are rejected before any other work is done
+app.add_middleware(RateLimitMiddleware)
+
+@app.post("/api/keys/reload", tags=["Authentication"], dependencies=[Depends(authenticate_api_key)])
+async def reload_api_keys():
+    """
+    Reloads the API keys file immediately instead of waiting for the next change check.
+    """
+    try:
+        api_keys.load()
+    except (OSError, ValueError) as e:
+        raise HTTPException(status_code=500, detail=f"Failed to reload API keys: {e}")
+    return {"keys": len(api_keys.plain_keys) + len(api_keys.hashed_keys)}
 
 # Model for product data
 class Product(BaseModel):
@@ -66,6 +1255,7 @@ class Product(BaseModel):
     link: str
     price_no_discount: str
     image_url: str
+    price_value: float # numeric price, parsed once when the product is scraped
 
 # Model for scraped data
 class ScrapeResult(BaseModel):
@@ -73,9 +1263,13 @@ class ScrapeResult(BaseModel):
     views: int # same for this, updated to int data type
     products: List[Product]
 
+# Model for a filled page, continued with next_cursor instead of a page number
+class SearchPage(ScrapeResult):
+    next_cursor: Optional[str]
+
 # Function to scrape website (omitted for brevity)
 
-def scrape_website(pagenumber: int = Query(1, description="Page number to scrape"),
+async def scrape_website(pagenumber: int = Query(1, description="Page number to scrape"),
                    orderby: str = Query("10", description="Order by: 10 - Price: Low to High, 11 - Price: High to Low, 16 - Newest, 17 - Highest Discount"),
                    q: str = Query("laptop", description="Search query"),
                    advs: bool = Query(False, description="Advs"),
@@ -99,56 +1293,97 @@ def scrape_website(pagenumber: int = Query(1, description="Page number to scrape
         "price": price_range
     }
 
-    response = requests.get(base_url, params=params)
+    response = await upstream.get(base_url, params=params)
     if response.status_code == 200:
-        json_data = response.json()
-        total_pages = json_data.get("totalpages", "N/A")
-        views = json_data.get("totalHits", "N/A")
-        html_content = json_data.get("html", "")
-
-        soup = BeautifulSoup(html_content, "html.parser")
+        total_pages, views, search_items = await run_parser(parse_search_page, response.content)
 
         products = []
-        for item_box in soup.find_all("div", class_="item-box"):
-            product_title = item_box.find("h2", class_="product-title").text.strip()
-            price = item_box.find("span", class_="price").text.strip()
-            
+        for product_title, price, discount, product_link, image_url in search_items:
+            price_value = get_price_value(price)
             # Filter products based on price range
             if startprice is not None and maxprice is not None:
-                price_value = get_price_value(price)
                 if price_value < startprice or price_value > maxprice:
                     continue
             
-            discount_label = item_box.find("div", class_="discount__label")
-            discount = discount_label.text.strip() if discount_label else None
-            product_link = item_box.find("a")["href"]
             price_no_discount = price  # Assume availability holds the price without discount
-            image_url = item_box.find("img")["src"]
 
-            product = Product(
+            # The extracted values are already strings, so the model is built without validating them again
+            product = Product.model_construct(
                 title=product_title,
                 price=price,
                 discount=discount,
                 link=product_link,
                 price_no_discount=price_no_discount,
                 image_url=image_url,
+                price_value=price_value,
             )
             products.append(product)
         
-        # Sort products based on orderby criteria
-        if orderby == "10":
-            products.sort(key=lambda x: float(re.sub(r'[^0-9.]', '', x.price)))
-        elif orderby == "11":
-            products.sort(key=lambda x: -float(re.sub(r'[^0-9.]', '', x.price)))
-        elif orderby == "16":
-            products.sort(key=lambda x: x.full_description)  # Example sorting by description
-        elif orderby == "17":
-            products.sort(key=lambda x: x.discount if x.discount else "0", reverse=True)  # Sorting by discount if available
+        sort_products(products, orderby)
         
         return ScrapeResult(total_pages=total_pages, views=views, products=products)
     else:
         return None
 
+def sort_products(products: List[Product], orderby: str):
+    """Sorts products in place based on orderby criteria."""
+    if orderby == "10":
+        products.sort(key=lambda x: x.price_value)
+    elif orderby == "11":
+        products.sort(key=lambda x: -x.price_value)
+    elif orderby == "17":
+        products.sort(key=lambda x: x.discount if x.discount else "0", reverse=True)  # Sorting by discount if available
+    # "16" (Newest) and "0" (Most relevant) keep the order returned by gjirafa50.com
+
+def parse_search_page(content: bytes) -> Tuple[object, object, List[tuple]]:
+    """
+    Parses a raw search response into (total_pages, views, search items). Runs in the parse executor.
+    """
+    json_data = json.loads(content)
+    total_pages = json_data.get("totalpages", "N/A")
+    views = json_data.get("totalHits", "N/A")
+    html_content = json_data.get("html", "")
+    return total_pages, views, extract_search_items(html_content)
+
+def extract_search_items(html_content: str) -> List[tuple]:
+    """
+    Extracts (title, price, discount, link, image_url) for every item-box in a search results page.
+    """
+    if HTML_PARSER == "lxml" and lxml_html is not None:
+        return extract_search_items_lxml(html_content)
+    return extract_search_items_soup(html_content)
+
+def extract_search_items_soup(html_content: str) -> List[tuple]:
+    soup = parse_html(html_content, SEARCH_RESULTS_STRAINER)
+    items = []
+    for item_box in soup.find_all("div", class_="item-box"):
+        product_title = item_box.find("h2", class_="product-title").text.strip()
+        price = item_box.find("span", class_="price").text.strip()
+        discount_label = item_box.find("div", class_="discount__label")
+        discount = discount_label.text.strip() if discount_label else None
+        product_link = item_box.find("a")["href"]
+        image_url = item_box.find("img")["src"]
+        items.append((product_title, price, discount, product_link, image_url))
+    return items
+
+def extract_search_items_lxml(html_content: str) -> List[tuple]:
+    # Same lookups as extract_search_items_soup, done with precompiled XPath expressions
+    try:
+        root = lxml_html.fromstring(html_content)
+    except lxml_etree.ParserError:
+        # Markup without any element, e.g. an empty or comment-only "no results" page
+        return []
+    items = []
+    for item_box in SEARCH_XPATHS["item_box"](root):
+        product_title = SEARCH_XPATHS["title"](item_box)[0].text_content().strip()
+        price = SEARCH_XPATHS["price"](item_box)[0].text_content().strip()
+        discount_label = SEARCH_XPATHS["discount"](item_box)
+        discount = discount_label[0].text_content().strip() if discount_label else None
+        product_link = SEARCH_XPATHS["link"](item_box)[0].attrib["href"]
+        image_url = SEARCH_XPATHS["image"](item_box)[0].attrib["src"]
+        items.append((product_title, price, discount, product_link, image_url))
+    return items
+
 def get_price_value(price_str: str) -> float:
     """Extracts the numeric part of the price string and converts it to a float."""
     try:
@@ -159,8 +1394,89 @@ def get_price_value(price_str: str) -> float:
         # Handle cases where conversion to float fails
         return 0.0  # Return 0.0 as a default value or handle the error as needed
 
+def search_cache_key(pagenumber, orderby, q, advs, hls, is_param, startprice, maxprice):
+    """Builds the canonical cache key for a search from its normalized parameters."""
+    price_range = (startprice, maxprice) if startprice is not None and maxprice is not None else None
+    return (q.strip().casefold(), orderby, pagenumber, advs, hls, is_param, price_range)
+
+async def search_website(pagenumber, orderby, q, advs=False, hls=False, is_param=False, startprice=None, maxprice=None, _=None):
+    """
+    Runs scrape_website through the search cache, coalescing identical concurrent searches.
+    """
+    # The "_" timestamp is left out of the key so identical searches can be reused
+    cache_key = search_cache_key(pagenumber, orderby, q, advs, hls, is_param, startprice, maxprice)
+    if _ is None:
+        _ = int(datetime.now().timestamp() * 1000)
+    return await cached_call(search_cache, cache_key,
+                             lambda: flights.do(("search",) + cache_key,
+                                                lambda: scrape_website(pagenumber, orderby, q, advs, hls, is_param, startprice, maxprice, _)))
+
+def search_cursor_scope(mode, orderby, q, advs, hls, is_param, startprice, maxprice) -> str:
+    """Short hash of the normalized search a cursor belongs to, so it cannot be replayed against another search."""
+    key = (mode,) + search_cache_key(None, orderby, q, advs, hls, is_param, startprice, maxprice)
+    return hashlib.sha256(repr(key).encode()).hexdigest()[:12]
+
+def encode_search_cursor(pagenumber: int, offset: int, page_size: int, scope: str) -> str:
+    """
+    Encodes a page number, the number of its products already returned, the page size and the search
+    scope as an opaque cursor.
+    """
+    return base64.urlsafe_b64encode(f"{pagenumber}:{offset}:{page_size}:{scope}".encode()).decode().rstrip("=")
+
+def decode_search_cursor(cursor: str, scope: str) -> Tuple[int, int, int]:
+    """
+    Decodes a cursor into (pagenumber, offset, page_size).
+
+    Raises:
+        HTTPException: 400 if the cursor is malformed or was issued for a different search.
+    """
+    try:
+        pagenumber, offset, page_size, cursor_scope = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode().split(":")
+        pagenumber, offset, page_size = int(pagenumber), int(offset), int(page_size)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if pagenumber < 1 or offset < 0 or not 1 <= page_size <= SEARCH_MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not hmac.compare_digest(cursor_scope, scope):
+        raise HTTPException(status_code=400, detail="Cursor does not belong to this search")
+    return pagenumber, offset, page_size
+
+async def fill_search_page(pagenumber: int, offset: int, page_size: int, search_args: tuple, scope: str) -> Optional[SearchPage]:
+    """
+    Collects page_size matching products starting at the given upstream page and offset, fetching further
+    upstream pages while the price filter leaves the page short. Returns None if the first page fails.
+    """
+    products = []
+    next_cursor = None
+    first_page = None
+    for fetched in range(SEARCH_FILL_MAX_PAGES):
+        page = await search_website(pagenumber, *search_args)
+        if page is None:
+            if first_page is None:
+                return None
+            # Let the client resume from the page that failed
+            next_cursor = encode_search_cursor(pagenumber, offset, page_size, scope)
+            break
+        if first_page is None:
+            first_page = page
+        remaining = page.products[offset:]
+        needed = page_size - len(products)
+        products.extend(remaining[:needed])
+        if len(remaining) > needed:
+            next_cursor = encode_search_cursor(pagenumber, offset + needed, page_size, scope)
+            break
+        offset = 0
+        if pagenumber >= page.total_pages:
+            break
+        pagenumber += 1
+        if len(products) == page_size or fetched == SEARCH_FILL_MAX_PAGES - 1:
+            next_cursor = encode_search_cursor(pagenumber, 0, page_size, scope)
+            break
+    return SearchPage.model_construct(total_pages=first_page.total_pages, views=first_page.views, products=products,
+                                      next_cursor=next_cursor)
+
 @app.get("/api/search", response_model=ScrapeResult, tags=["Search"], dependencies=[Depends(authenticate_api_key)])
-def search_products(pagenumber: int = Query(..., ge=1, description="Page number to search"),
+async def search_products(pagenumber: Optional[int] = Query(None, ge=1, description="Page number to search (default is 1), not needed with cursor"),
                     orderby: str = Query(..., regex=r"^(0|10|11|16|17)$", description="Order by: 0: Most relevant, 10 - Price: Low to High, 11 - Price: High to Low, 16 - Newest, 17 - Highest Discount"),
                     q: str = Query(..., min_length=1, description="Search query"),
                     advs: bool = Query(False, description="Advs"),
@@ -168,14 +1484,17 @@ def search_products(pagenumber: int = Query(..., ge=1, description="Page number
                     is_param: bool = Query(False, description="Is = Remove all sold out products "),
                     startprice: Optional[int] = Query(None, ge=0, description="Start price"),
                     maxprice: Optional[int] = Query(None, ge=0, description="Max price"),
-                    _: int = Query(int(datetime.now().timestamp() * 1000), description="Underscore parameter = Current Time Snowflake ")):
+                    _: int = Query(int(datetime.now().timestamp() * 1000), description="Underscore parameter = Current Time Snowflake "),
+                    mode: str = Query("live", pattern=r"^(live|local)$", description="live: search gjirafa50.com, local: search the local catalog"),
+                    page_size: Optional[int] = Query(None, ge=1, le=SEARCH_MAX_PAGE_SIZE, description="Return this many matching products, fetching further pages as needed, with a next_cursor to continue"),
+                    cursor: Optional[str] = Query(None, description="next_cursor from a previous page_size response with the same search parameters, replaces pagenumber and page_size")):
     """
     Search for products.
     
     This endpoint searches for products based on the specified criteria and returns a list of matching products.
     
     Args:
-        pagenumber (int): Page number to search (default is 1).
+        pagenumber (Optional[int]): Page number to search, ignored when a cursor is given (default is 1).
         orderby (str): Order by parameter (default is "0").
         q (str): Search query (default is "laptop asus gaming").
         advs (bool): Advs parameter (default is False).
@@ -184,21 +1503,225 @@ def search_products(pagenumber: int = Query(..., ge=1, description="Page number
         startprice (Optional[int]): Start price for filtering products (default is None).
         maxprice (Optional[int]): Max price for filtering products (default is None).
         _ (int): Underscore parameter (default is the current timestamp in milliseconds).
+        mode (str): "live" to search gjirafa50.com, "local" to search the local catalog (default is "live").
+        page_size (Optional[int]): Number of matching products to return per page (default is None, one upstream page).
+        cursor (Optional[str]): Continuation cursor returned as next_cursor by a previous page_size search with the
+            same parameters. It carries the page number and page size (default is None).
+
+    Raises:
+        HTTPException: 400 if the cursor is invalid, was issued for other search parameters or another page_size.
+    """
+    if pagenumber is None:
+        pagenumber = 1
+    offset = 0
+    scope = search_cursor_scope(mode, orderby, q, advs, hls, is_param, startprice, maxprice)
+    if cursor is not None:
+        pagenumber, offset, cursor_page_size = decode_search_cursor(cursor, scope)
+        if page_size is not None and page_size != cursor_page_size:
+            raise HTTPException(status_code=400, detail="Cursor was issued for a different page_size")
+        page_size = cursor_page_size
+    if page_size is not None:
+        if mode == "local":
+            # The catalog filters in SQL, so every page is already full
+            page = catalog.search(q, orderby, pagenumber, startprice, maxprice, in_stock_only=is_param, page_size=page_size,
+                                  offset=offset)
+            has_more = (pagenumber - 1) * page_size + offset + len(page.products) < page.views
+            next_cursor = encode_search_cursor(pagenumber + 1, offset, page_size, scope) if has_more else None
+            scraped_data = SearchPage.model_construct(total_pages=page.total_pages, views=page.views,
+                                                      products=page.products, next_cursor=next_cursor)
+        else:
+            scraped_data = await fill_search_page(pagenumber, offset, page_size,
+                                                  (orderby, q, advs, hls, is_param, startprice, maxprice, _), scope)
+    elif mode == "local":
+        scraped_data = catalog.search(q, orderby, pagenumber, startprice, maxprice, in_stock_only=is_param)
+    else:
+        scraped_data = await search_website(pagenumber, orderby, q, advs, hls, is_param, startprice, maxprice, _)
+    if scraped_data:
+        # The result is already a validated ScrapeResult, so it is serialized directly instead of through response_model
+        return Response(content=scraped_data.model_dump_json(), media_type="application/json")
+    else:
+        raise HTTPException(status_code=500, detail="Failed to search for products")
+
+
+@app.get("/api/search/all", tags=["Search"], dependencies=[Depends(authenticate_api_key)])
+async def search_all_products(orderby: str = Query(..., pattern=r"^(0|10|11|16|17)$", description="Order by: 0: Most relevant, 10 - Price: Low to High, 11 - Price: High to Low, 16 - Newest, 17 - Highest Discount"),
+                              q: str = Query(..., min_length=1, description="Search query"),
+                              advs: bool = Query(False, description="Advs"),
+                              hls: bool = Query(False, description="Hls = Filter Products that ship within 24h "),
+                              is_param: bool = Query(False, description="Is = Remove all sold out products "),
+                              startprice: Optional[int] = Query(None, ge=0, description="Start price"),
+                              maxprice: Optional[int] = Query(None, ge=0, description="Max price"),
+                              max_pages: Optional[int] = Query(None, ge=1, description="Maximum number of pages to fetch"),
+                              sort: bool = Query(False, description="Sort all products by orderby before returning them instead of streaming them as pages arrive")):
+    """
+    Search for products across all result pages.
+
+    The first page is fetched to learn the number of pages, then the remaining pages are fetched
+    in parallel and their products are streamed back as newline-delimited JSON, one product per
+    line, as soon as each page arrives. Products are de-duplicated by link. With `sort`, all
+    products are collected and sorted by `orderby` across pages before being returned.
+
+    Args:
+        orderby (str): Order by parameter.
+        q (str): Search query.
+        advs (bool): Advs parameter (default is False).
+        hls (bool): Hls parameter (default is False).
+        is_param (bool): Is parameter (default is False).
+        startprice (Optional[int]): Start price for filtering products (default is None).
+        maxprice (Optional[int]): Max price for filtering products (default is None).
+        max_pages (Optional[int]): Maximum number of pages to fetch (default and upper bound is SEARCH_ALL_MAX_PAGES).
+        sort (bool): Sort the products across all pages (default is False).
+
+    Returns:
+        StreamingResponse: Newline-delimited JSON (application/x-ndjson). The total number of pages
+        is returned in the X-Total-Pages header. A page that fails produces a line with its
+        `pagenumber` and an `error` message.
+    """
+    search_args = (orderby, q, advs, hls, is_param, startprice, maxprice)
+    first_page = await search_website(1, *search_args)
+    if not first_page:
+        raise HTTPException(status_code=500, detail="Failed to search for products")
+    last_page = min(first_page.total_pages, max_pages or SEARCH_ALL_MAX_PAGES, SEARCH_ALL_MAX_PAGES)
+    return StreamingResponse(stream_search_pages(first_page, last_page, search_args, sort),
+                             media_type="application/x-ndjson",
+                             headers={"X-Total-Pages": str(first_page.total_pages)})
+
+async def stream_search_pages(first_page: ScrapeResult, last_page: int, search_args: tuple, sort: bool):
+    semaphore = asyncio.Semaphore(SEARCH_ALL_CONCURRENCY)
+    seen_links = set()
+    collected = []
+
+    async def fetch_page(pagenumber: int):
+        async with semaphore:
+            try:
+                return pagenumber, await search_website(pagenumber, *search_args), None
+            except HTTPException as e:
+                return pagenumber, None, e.detail
+            except Exception as e:
+                return pagenumber, None, str(e)
+
+    def new_products(page: ScrapeResult) -> List[Product]:
+        products = []
+        for product in page.products:
+            if product.link not in seen_links:
+                seen_links.add(product.link)
+                products.append(product)
+        return products
+
+    def to_lines(products: List[Product]) -> bytes:
+        return b"".join(product.model_dump_json().encode("utf-8") + b"\n" for product in products)
+
+    products = new_products(first_page)
+    if sort:
+        collected.extend(products)
+    elif products:
+        yield to_lines(products)
+
+    tasks = [asyncio.ensure_future(fetch_page(pagenumber)) for pagenumber in range(2, last_page + 1)]
+    try:
+        for completed in asyncio.as_completed(tasks):
+            pagenumber, page, error = await completed
+            if page is None:
+                yield encode_json({"pagenumber": pagenumber, "error": error or "Failed to search for products"}) + b"\n"
+                continue
+            products = new_products(page)
+            if sort:
+                collected.extend(products)
+            elif products:
+                yield to_lines(products)
+    finally:
+        # Stop outstanding page fetches if the client disconnects mid-stream
+        for task in tasks:
+            task.cancel()
+
+    if sort:
+        sort_products(collected, search_args[0])
+        yield to_lines(collected)
+
+@app.get("/api/cache/stats", tags=["Cache"], dependencies=[Depends(authenticate_api_key)])
+async def get_cache_stats():
+    """
+    Returns size and hit/miss counters for the response caches.
+    """
+    return {name: cache.stats() for name, cache in caches.items()}
+
+@app.get("/api/upstream/stats", tags=["Cache"], dependencies=[Depends(authenticate_api_key)])
+async def get_upstream_stats():
+    """
+    Returns retry and hedging counters, and the circuit breaker state and p95 latency of every upstream host.
+    """
+    return upstream.stats()
+
+# Circuit breaker states as exported at /metrics
+BREAKER_STATE_VALUES = {"closed": 0, "half_open": 1, "open": 2}
+
+def render_metrics() -> str:
+    """Renders the service metrics of this worker in the Prometheus text format."""
+    lines = upstream_latency.render() + parse_latency.render()
+
+    stats = upstream.stats()
+    for name, help in (("retried", "Upstream requests that were retried."),
+                       ("hedged", "Upstream requests that were hedged with a second request."),
+                       ("rejected", "Upstream requests rejected by an open circuit breaker."),
+                       ("shed", "Upstream requests rejected because too many were in flight."),
+                       ("errors", "Upstream requests that failed without a response.")):
+        lines += [f"# HELP gjirafa50_upstream_{name}_total {help}", f"# TYPE gjirafa50_upstream_{name}_total counter",
+                  f"gjirafa50_upstream_{name}_total {stats[name]}"]
+    lines += ["# HELP gjirafa50_upstream_in_flight Upstream requests in flight.", "# TYPE gjirafa50_upstream_in_flight gauge",
+              f"gjirafa50_upstream_in_flight {stats['in_flight']}"]
+    lines += ["# HELP gjirafa50_upstream_breaker_state Circuit breaker state: 0 closed, 1 half open, 2 open.",
+              "# TYPE gjirafa50_upstream_breaker_state gauge"]
+    lines += [f'gjirafa50_upstream_breaker_state{{host="{metrics_label(host)}"}} {BREAKER_STATE_VALUES[host_stats["breaker"]]}'
+              for host, host_stats in stats["hosts"].items()]
+
+    cache_stats = {name: cache.stats() for name, cache in caches.items()}
+    lines += ["# HELP gjirafa50_cache_lookups_total Cache lookups by result.", "# TYPE gjirafa50_cache_lookups_total counter"]
+    for name, counters in cache_stats.items():
+        for result, counter in (("hit", "hits"), ("stale", "stale_hits"), ("miss", "misses")):
+            lines.append(f'gjirafa50_cache_lookups_total{{cache="{name}",result="{result}"}} {counters[counter]}')
+    lines += ["# HELP gjirafa50_cache_hit_ratio Fraction of cache lookups answered from the cache.",
+              "# TYPE gjirafa50_cache_hit_ratio gauge"]
+    lines += [f'gjirafa50_cache_hit_ratio{{cache="{name}"}} {counters["hit_rate"]}' for name, counters in cache_stats.items()]
+    lines += ["# HELP gjirafa50_cache_entries Entries in the cache.", "# TYPE gjirafa50_cache_entries gauge"]
+    lines += [f'gjirafa50_cache_entries{{cache="{name}"}} {counters["size"]}' for name, counters in cache_stats.items()]
+
+    lines += ["# HELP gjirafa50_requests_total Requests made with a valid API key, by user and status code.",
+              "# TYPE gjirafa50_requests_total counter"]
+    lines += [f'gjirafa50_requests_total{{user="{metrics_label(user)}",status="{status}"}} {count}'
+              for (user, status), count in key_requests.items()]
+    return "\n".join(lines) + "\n"
+
+async def authenticate_metrics(authorization: Optional[str] = Header(None)):
+    # The metrics name every user, so they are only served to the monitoring system, not to API key holders
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if authorization is None or not hmac.compare_digest(authorization.encode(), f"Bearer {METRICS_TOKEN}".encode()):
+        raise UnauthorizedAccess()
+
+@app.get("/metrics", tags=["Metrics"], dependencies=[Depends(authenticate_metrics)])
+async def get_metrics():
     """
-    scraped_data = scrape_website(pagenumber, orderby, q, advs, hls, is_param, startprice, maxprice, _)
-    if scraped_data:
-        return scraped_data
-    else:
-        raise HTTPException(status_code=500, detail="Failed to search for products")
+    Returns upstream latency histograms, parse times, cache hit rates and per-user request counts in the
+    Prometheus text format. The metrics are kept per worker process.
+
+    Requires the `Authorization: Bearer <METRICS_TOKEN>` header.
+    """
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 
 @app.get("/api/product/details", dependencies=[Depends(authenticate_api_key)])
-async def get_product_details(product_url: str):
+async def get_product_details(product_url: str,
+                              fields: Optional[str] = Query(None, description="Comma-separated list of fields to return, e.g. Price,InStock (default is all fields)"),
+                              mode: str = Query("live", pattern=r"^(live|local)$", description="live: fetch from gjirafa50.com, local: read from the local catalog")):
     """
     Retrieve details of a product from its URL.
 
     Args:
         product_url (str): The URL of the product.
+        fields (Optional[str]): Comma-separated list of fields to return. Only the requested fields are computed,
+        and the page HTML is only parsed when DeliveryTimes is requested.
+        mode (str): "live" to fetch the product page, "local" to read the product from the local catalog (default is "live").
+        The local catalog does not store DeliveryTimes.
 
     Returns:
         dict: A dictionary containing the short description, full description (without HTML tags), product specification model, delivery times for Prishtinë and Kosovë, të tjera,
@@ -207,56 +1730,193 @@ async def get_product_details(product_url: str):
     Raises:
         HTTPException: If the URL is invalid, or if there is an error fetching or parsing the product page.
     """
-    
+    # Check if the URL is valid
+    if not is_valid_url(product_url):
+        raise HTTPException(status_code=400, detail="Invalid URL provided.")
+    selected_fields = parse_product_fields(fields)
+
+    if mode == "local":
+        details = catalog.get_details(product_path(product_url))
+        if details is None:
+            raise HTTPException(status_code=404, detail="Product not found in the local catalog.")
+        return FastJSONResponse({field: details[field] for field in selected_fields if field in details})
+
+    # Concurrent requests for the same product share one fetch and parse
+    return FastJSONResponse(await product_details_or_cached(product_url, selected_fields))
+
+def strip_html_tags(text):
+    return re.sub('<[^<]+?>', '', text)
+
+# Fields returned by the product details endpoint, in response order, with the function computing each one from the product model
+PRODUCT_DETAIL_FIELDS = {
+    "Name": lambda product_models: product_models.get("Name", ""),
+    "Price": lambda product_models: product_models.get("ProductPrice", {}).get("Price", ""),
+    "PriceWithDiscount": lambda product_models: product_models.get("ProductPrice", {}).get("PriceWithDiscount", ""),
+    "InStock": lambda product_models: product_models.get("InStock", False),
+    "StockQuantity": lambda product_models: product_models.get("StockQuantity", 0),
+    "ShortDescription": lambda product_models: strip_html_tags(product_models.get("ShortDescription", "Short Description not available")).strip(),
+    "FullDescription": lambda product_models: strip_html_tags(product_models.get("FullDescription", "Full Description not available")).strip(),
+    "ProductSpecificationModel": lambda product_models: simplify_specification(product_models),
+    # Delivery times come from the page HTML rather than the product model
+    "DeliveryTimes": None,
+    "ImageModels": lambda product_models: prepare_image_data(product_models),
+}
+
+def parse_product_fields(fields: Optional[str]) -> Tuple[str, ...]:
+    """
+    Parses a comma-separated field projection into a tuple of field names in response order.
+    """
+    if fields is None or not fields.strip():
+        return tuple(PRODUCT_DETAIL_FIELDS)
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - PRODUCT_DETAIL_FIELDS.keys()
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}. Valid fields are: {', '.join(PRODUCT_DETAIL_FIELDS)}.")
+    return tuple(field for field in PRODUCT_DETAIL_FIELDS if field in requested)
+
+async def fetch_product_details(product_url: str, fields: Tuple[str, ...] = tuple(PRODUCT_DETAIL_FIELDS)) -> dict:
+    """
+    Fetch a product page and extract the requested fields of its details.
+
+    Raises:
+        HTTPException: If there is an error fetching or parsing the product page.
+    """
     try:
-        # Check if the URL is valid
-        if not is_valid_url(product_url):
-            raise HTTPException(status_code=400, detail="Invalid URL provided.")
-        
-        response = requests.get(product_url)
+        if "DeliveryTimes" not in fields:
+            # Everything else comes from the productModel, so stop downloading once it has been read
+            status_code, product_model_json = await fetch_embedded_json(product_url, "productModel")
+            if status_code != 200:
+                raise HTTPException(status_code=500, detail="Failed to fetch the product page.")
+            if product_model_json is None:
+                raise HTTPException(status_code=500, detail="Product model not found on the page.")
+            details = await run_parser(parse_product_model_details, product_model_json, fields)
+            price_history.record_details(product_path(product_url), details)
+            return details
+
+        response = await upstream.get(product_url)
         if response.status_code == 200:
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # Extract delivery times
-            delivery_times = extract_delivery_times(soup)
-            
-            # Extract product models
-            product_models = extract_product_models(response.text)
-            
-            # Extract ShortDescription and FullDescription (remove HTML tags)
-            short_description = re.sub('<[^<]+?>', '', product_models.get("ShortDescription", "Short Description not available"))
-            full_description = re.sub('<[^<]+?>', '', product_models.get("FullDescription", "Full Description not available"))
-            
-            # Simplify ProductSpecificationModel
-            simplified_specification = simplify_specification(product_models)
-            
-            # Prepare image data
-            image_data = prepare_image_data(product_models)
-            
-            # Extract Price and PriceWithDiscount
-            product_price = product_models.get("ProductPrice", {})
-            price = product_price.get("Price", "")
-            price_with_discount = product_price.get("PriceWithDiscount", "")
-            
-            return {
-                "Name": product_models.get("Name", ""),
-                "Price": price,
-                "PriceWithDiscount": price_with_discount,
-                "InStock": product_models.get("InStock", False),
-                "StockQuantity": product_models.get("StockQuantity", 0),
-                "ShortDescription": short_description.strip(),
-                "FullDescription": full_description.strip(),
-                "ProductSpecificationModel": simplified_specification,
-                "DeliveryTimes": delivery_times,
-                "ImageModels": image_data
-            }
+            details = await run_parser(parse_product_page, response.content, response.encoding, fields)
+            if details is None:
+                raise HTTPException(status_code=500, detail="Product model not found on the page.")
+            price_history.record_details(product_path(product_url), details)
+            return details
         else:
             raise HTTPException(status_code=500, detail="Failed to fetch the product page.")
-    except HTTPException as e:
-        raise e
+    except (HTTPException, httpx.TransportError):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def product_details_or_cached(product_url: str, fields: Tuple[str, ...]) -> dict:
+    """
+    Fetches product details, coalescing concurrent requests for the same product.
+
+    When the upstream cannot be reached or its circuit breaker is open, the details stored in the local catalog
+    are returned instead.
+    """
+    try:
+        return await flights.do(("product", product_url, fields), lambda: fetch_product_details(product_url, fields))
+    except httpx.TransportError:
+        details = catalog.get_details(product_path(product_url))
+        if details is None:
+            raise
+        return {field: details[field] for field in fields if field in details}
+
+def build_product_details(product_models: Optional[dict], fields: Tuple[str, ...], html_content: Optional[str] = None) -> dict:
+    details = {}
+    for field in fields:
+        if field == "DeliveryTimes":
+            # Building the soup is the most expensive step, so it only happens for this field
+            soup = parse_html(html_content, DELIVERY_TIMES_STRAINER)
+            details[field] = extract_delivery_times(soup)
+        else:
+            details[field] = PRODUCT_DETAIL_FIELDS[field](product_models)
+    return details
+
+def parse_product_page(content: bytes, encoding: str, fields: Tuple[str, ...]) -> Optional[dict]:
+    """
+    Extracts the requested product details from a raw product page. Returns None if the page has no productModel.
+
+    Runs in the parse executor, so it only takes and returns picklable values.
+    """
+    html_content = content.decode(encoding or "utf-8", errors="replace")
+    product_models = None
+    if any(field != "DeliveryTimes" for field in fields):
+        product_model_json = find_embedded_json(html_content, "productModel")
+        if product_model_json is None:
+            return None
+        product_models = json.loads(product_model_json)
+    return build_product_details(product_models, fields, html_content)
+
+def parse_product_model_details(product_model_json: str, fields: Tuple[str, ...]) -> dict:
+    """
+    Extracts the requested product details from the productModel JSON. Runs in the parse executor.
+    """
+    return build_product_details(json.loads(product_model_json), fields)
+
+# Model for a batch of product URLs
+class ProductDetailsBatchRequest(BaseModel):
+    product_urls: List[str]
+    concurrency: Optional[int] = None
+    fields: Optional[str] = None
+
+@app.post("/api/product/details/batch", tags=["Product Details"], dependencies=[Depends(authenticate_api_key)])
+async def get_product_details_batch(batch: ProductDetailsBatchRequest):
+    """
+    Retrieve details of many products at once.
+
+    The product pages are fetched in parallel (up to `concurrency` at a time) and one JSON
+    line is streamed back per URL as soon as it completes, in completion order. Each line
+    contains the URL, its position in the request, a status code and either the product
+    details or an error message, so one bad URL does not fail the whole batch.
+
+    Args:
+        batch (ProductDetailsBatchRequest): The product URLs, an optional concurrency limit and an optional
+        comma-separated field projection (see /api/product/details).
+
+    Returns:
+        StreamingResponse: Newline-delimited JSON (application/x-ndjson).
+    """
+    if len(batch.product_urls) > BATCH_MAX_URLS:
+        raise HTTPException(status_code=400, detail=f"A batch can contain at most {BATCH_MAX_URLS} URLs.")
+    if batch.concurrency is not None and batch.concurrency < 1:
+        raise HTTPException(status_code=400, detail="Concurrency must be at least 1.")
+    concurrency = min(batch.concurrency or BATCH_MAX_CONCURRENCY, BATCH_MAX_CONCURRENCY)
+    selected_fields = parse_product_fields(batch.fields)
+    return StreamingResponse(stream_product_details(batch.product_urls, concurrency, selected_fields), media_type="application/x-ndjson")
+
+async def stream_product_details(product_urls: List[str], concurrency: int, fields: Tuple[str, ...]):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch_one(index: int, url: str) -> dict:
+        item = {"index": index, "product_url": url}
+        if not is_valid_url(url):
+            item.update(status=400, error="Invalid URL provided.")
+            return item
+        try:
+            async with semaphore:
+                details = await product_details_or_cached(url, fields)
+            item.update(status=200, details=details)
+        except HTTPException as e:
+            item.update(status=e.status_code, error=e.detail)
+        except UpstreamUnavailable as e:
+            item.update(status=503, error=str(e))
+        except httpx.TransportError as e:
+            item.update(status=502, error=f"Failed to reach gjirafa50.com: {e!r}")
+        except Exception as e:
+            item.update(status=500, error=str(e))
+        return item
+
+    tasks = [asyncio.ensure_future(fetch_one(index, url)) for index, url in enumerate(product_urls)]
+    try:
+        for completed in asyncio.as_completed(tasks):
+            item = await completed
+            yield encode_json(item) + b"\n"
+    finally:
+        # Stop outstanding fetches if the client disconnects mid-stream
+        for task in tasks:
+            task.cancel()
+
 def is_valid_url(url):
     """
     Checks if the given string is a valid URL for gjirafa50 website.
@@ -268,8 +1928,8 @@ def extract_delivery_times(soup):
     Extract delivery times from the parsed HTML.
     """
     delivery_times = {}
-    delivery_date_element_prishtine = soup.find("div", class_="flex flex-col justify-center pl-2 text-xs font-medium pr-2 mr-2 tablet:border-r")
-    delivery_date_element_tjera = soup.find("div", class_="flex flex-col justify-center pl-2 text-xs font-medium")
+    delivery_date_element_prishtine = soup.find("div", class_=DELIVERY_TIMES_CLASSES["Prishtinë"])
+    delivery_date_element_tjera = soup.find("div", class_=DELIVERY_TIMES_CLASSES["tjera"])
 
     if delivery_date_element_prishtine:
         # Extract the text content of the element and remove HTML tags
@@ -295,17 +1955,121 @@ def extract_delivery_times(soup):
     
     return delivery_times
 
+class EmbeddedJSONScanner:
+    """
+    Finds the JSON object assigned to `var <name> = {...};` in a page fed in chunks.
+
+    The object is scanned for balanced braces while skipping over string literals, so
+    a "};" inside a string does not end it early. Once the closing brace is seen the
+    rest of the page is not needed, which lets callers stop downloading it.
+    """
+
+    # Outside of a string only braces and quotes matter, inside of one only quotes and escapes
+    _structure_pattern = re.compile(r'[{}"]')
+    _string_pattern = re.compile(r'["\\]')
+
+    def __init__(self, name: str):
+        self._marker_pattern = re.compile(r"var\s+" + re.escape(name) + r"\s*=\s*\{")
+        # The start of a marker cut off by the end of the buffer, however much whitespace it contains
+        partial = ""
+        for token in reversed(["a", "r", r"\s+"] + [re.escape(char) for char in name] + [r"\s*", "=", r"\s*"]):
+            partial = f"(?:{token}{partial})?"
+        self._partial_marker_pattern = re.compile(f"v{partial}\\Z")
+        self._buffer = ""
+        self._found = False
+        self._position = 0
+        self._depth = 0
+        self._in_string = False
+        self.result: Optional[str] = None
+
+    @property
+    def done(self) -> bool:
+        return self.result is not None
+
+    def feed(self, chunk: str) -> bool:
+        """Adds the next chunk of the page. Returns True once the whole object has been found."""
+        if self.done:
+            return True
+        self._buffer += chunk
+        if not self._found:
+            match = self._marker_pattern.search(self._buffer)
+            if match is None:
+                # Keep only what may be the beginning of a marker split across chunks
+                partial = self._partial_marker_pattern.search(self._buffer)
+                self._buffer = self._buffer[partial.start():] if partial else ""
+                return False
+            self._found = True
+            # Keep only the object itself, starting at its opening brace
+            self._buffer = self._buffer[match.end() - 1:]
+        return self._scan()
+
+    def _scan(self) -> bool:
+        buffer = self._buffer
+        position = self._position
+        while True:
+            if self._in_string:
+                match = self._string_pattern.search(buffer, position)
+                if match is None:
+                    break
+                if match.group() == "\\":
+                    if match.end() >= len(buffer):
+                        # The escaped character has not arrived yet
+                        position = match.start()
+                        break
+                    position = match.end() + 1
+                    continue
+                self._in_string = False
+                position = match.end()
+            else:
+                match = self._structure_pattern.search(buffer, position)
+                if match is None:
+                    break
+                token = match.group()
+                position = match.end()
+                if token == '"':
+                    self._in_string = True
+                elif token == "{":
+                    self._depth += 1
+                else:
+                    self._depth -= 1
+                    if self._depth == 0:
+                        self.result = buffer[:position]
+                        self._buffer = ""
+                        return True
+        self._position = min(position, len(buffer))
+        return False
+
+
+def find_embedded_json(html_content: str, name: str) -> Optional[str]:
+    """
+    Returns the source of the JSON object assigned to `var <name>` in the page, or None if it is not there.
+    """
+    scanner = EmbeddedJSONScanner(name)
+    scanner.feed(html_content)
+    return scanner.result
+
+async def fetch_embedded_json(url: str, name: str, params: Optional[dict] = None) -> Tuple[int, Optional[str]]:
+    """
+    Streams a page and returns its status code and the source of the JSON object assigned to `var <name>`.
+
+    The download stops as soon as the object is closed instead of reading the whole page.
+    """
+    async with upstream.stream(url, params=params) as response:
+        if response.status_code != 200:
+            return response.status_code, None
+        scanner = EmbeddedJSONScanner(name)
+        async for chunk in response.aiter_text():
+            if scanner.feed(chunk):
+                break
+        return response.status_code, scanner.result
+
 def extract_product_models(response_text):
     """
     Extract product models from the response text.
     """
-    product_model_pattern = re.compile(r"var productModel = (\{.*?\});", re.DOTALL)
-    product_model_match = product_model_pattern.search(response_text)
+    product_model_json = find_embedded_json(response_text, "productModel")
     
-    if product_model_match:
-        # Extract the productModel dictionary/json
-        product_model_json = product_model_match.group(1)
-        
+    if product_model_json is not None:
         # Convert the JSON string to a Python dictionary
         product_model_dict = json.loads(product_model_json)
         
@@ -351,41 +2115,107 @@ def prepare_image_data(product_models):
 
 
 
-# Function to fetch categories and subcategories from gjirafa50.com
-def fetch_categories():
-    url = "https://gjirafa50.com"
-    try:
-        response = requests.get(url)
-        if response.status_code == 200:
-            soup = BeautifulSoup(response.content, 'html.parser')
-            category_elements = soup.find_all('li', class_='category-item')
-            categories = {}
-            for category_element in category_elements:
-                category_name_element = category_element.find('a', class_='category-item-content')
-                category_name = category_name_element.get_text(strip=True)
-                category_url = category_name_element['href']
-                if category_element.find('ul', class_='sublist'):
-                    subcategories_element = category_element.find('ul', class_='sublist')
-                    subcategories = []
-                    for subcategory_element in subcategories_element.find_all('a', class_='category-item-content'):
-                        subcategory_name = subcategory_element.get_text(strip=True)
-                        subcategory_url = subcategory_element['href']
-                        subcategories.append({
-                            'name': subcategory_name,
-                            'url': subcategory_url
-                        })
-                    categories[category_name] = subcategories
-                elif category_url not in categories:
-                    categories[category_name] = [{'name': category_name, 'url': category_url}]
-            return categories
+# Function to extract categories and subcategories from the gjirafa50.com homepage
+def extract_categories(soup):
+    category_elements = soup.find_all('li', class_='category-item')
+    categories = {}
+    for category_element in category_elements:
+        category_name_element = category_element.find('a', class_='category-item-content')
+        category_name = category_name_element.get_text(strip=True)
+        category_url = category_name_element['href']
+        if category_element.find('ul', class_='sublist'):
+            subcategories_element = category_element.find('ul', class_='sublist')
+            subcategories = []
+            for subcategory_element in subcategories_element.find_all('a', class_='category-item-content'):
+                subcategory_name = subcategory_element.get_text(strip=True)
+                subcategory_url = subcategory_element['href']
+                subcategories.append({
+                    'name': subcategory_name,
+                    'url': subcategory_url
+                })
+            categories[category_name] = subcategories
+        elif category_url not in categories:
+            categories[category_name] = [{'name': category_name, 'url': category_url}]
+    return categories
+
+def fold_text(text: str) -> str:
+    """Case-folds text and strips diacritics, so "Kamerë" and "kamere" compare equal."""
+    return "".join(char for char in unicodedata.normalize("NFKD", text.casefold()) if not unicodedata.combining(char))
+
+def trigrams(text: str) -> set:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class CategoryIndex:
+    """
+    Lookup structures for /api/categories, rebuilt whenever the homepage snapshot is refreshed.
+
+    Names are folded with fold_text and indexed by trigram, categories are kept sorted by
+    their number of subcategories for range lookups, and the unfiltered responses are
+    serialized ahead of time together with their ETag.
+    """
+
+    def __init__(self, categories: dict):
+        self.categories = categories
+        self.names = list(categories)
+        self.folded_names = [fold_text(name) for name in self.names]
+        self.folded_subcategory_names = [[fold_text(subcategory["name"]) for subcategory in categories[name]] for name in self.names]
+        self.counts = [len(categories[name]) for name in self.names]
+
+        # Category positions sorted by number of subcategories
+        self.positions_by_count = sorted(range(len(self.names)), key=lambda position: self.counts[position])
+        self.sorted_counts = [self.counts[position] for position in self.positions_by_count]
+
+        # Trigram -> positions of the categories whose name (or a subcategory name) contains it
+        self.name_trigrams: Dict[str, set] = {}
+        self.subcategory_trigrams: Dict[str, set] = {}
+        for position, folded_name in enumerate(self.folded_names):
+            for trigram in trigrams(folded_name):
+                self.name_trigrams.setdefault(trigram, set()).add(position)
+            for folded_subcategory_name in self.folded_subcategory_names[position]:
+                for trigram in trigrams(folded_subcategory_name):
+                    self.subcategory_trigrams.setdefault(trigram, set()).add(position)
+
+        # Serialized unfiltered responses and their ETags, keyed by include_empty_categories
+        self.responses = {}
+        for include_empty in (False, True):
+            body = encode_json(self.filter(include_empty_categories=include_empty))
+            self.responses[include_empty] = (body, make_etag(body))
+
+    def _matching_positions(self, folded_query: str, search_subcategories: bool) -> set:
+        if len(folded_query) >= 3:
+            query_trigrams = trigrams(folded_query)
+            candidates = set.intersection(*(self.name_trigrams.get(trigram, set()) for trigram in query_trigrams))
+            if search_subcategories:
+                candidates |= set.intersection(*(self.subcategory_trigrams.get(trigram, set()) for trigram in query_trigrams))
         else:
-            return None
-    except Exception as e:
-        print(f"An error occurred: {str(e)}")
-        return None
+            candidates = range(len(self.names))
+        # Trigrams only narrow the candidates down, the substring check is what decides a match
+        return {
+            position for position in candidates
+            if folded_query in self.folded_names[position]
+            or (search_subcategories and any(folded_query in name for name in self.folded_subcategory_names[position]))
+        }
 
-# Load categories on startup
-categories_data = fetch_categories()
+    def filter(self, q: Optional[str] = None, min_subcategories: Optional[int] = None, max_subcategories: Optional[int] = None,
+               include_empty_categories: bool = False, search_subcategories: bool = False) -> dict:
+        low = min_subcategories if min_subcategories is not None else 0
+        if not include_empty_categories:
+            low = max(low, 1)
+        start = bisect.bisect_left(self.sorted_counts, low)
+        end = bisect.bisect_right(self.sorted_counts, max_subcategories) if max_subcategories is not None else len(self.sorted_counts)
+        positions = set(self.positions_by_count[start:end])
+        if q:
+            positions &= self._matching_positions(fold_text(q), search_subcategories)
+        # Keep the order the categories appear in on gjirafa50.com
+        return {self.names[position]: self.categories[self.names[position]] for position in sorted(positions)}
+
+
+category_index: Optional[CategoryIndex] = None
+
+def rebuild_category_index(snapshot):
+    global category_index
+    category_index = CategoryIndex(snapshot.categories) if snapshot.categories else None
 
 @app.get("/api/categories", dependencies=[Depends(authenticate_api_key)], tags=["Categories"])
 async def get_categories(
@@ -393,20 +2223,25 @@ async def get_categories(
     min_subcategories: Optional[int] = Query(None, description="Minimum number of subcategories"),
     max_subcategories: Optional[int] = Query(None, description="Maximum number of subcategories"),
     include_empty_categories: Optional[bool] = Query(False, description="Include categories with no subcategories"),
+    search_subcategories: bool = Query(False, description="Also match the search query against subcategory names"),
+    if_none_match: Optional[str] = Header(None),
     ):
-    """Fetches and returns a list of available categories."""
-    if categories_data:
-        filtered_categories = {}
-        for category, subcategories in categories_data.items():
-            num_subcategories = len(subcategories)
-            if (min_subcategories is None or num_subcategories >= min_subcategories) and \
-               (max_subcategories is None or num_subcategories <= max_subcategories) and \
-               (include_empty_categories or num_subcategories > 0) and \
-               (q.lower() in category.lower() if q else True):
-                filtered_categories[category] = subcategories
-        return filtered_categories
-    else:
+    """
+    Fetches and returns a list of available categories.
+
+    The search query is matched case-insensitively and ignoring diacritics (ë, ç). The unfiltered
+    list is returned with an ETag, and a request with a matching If-None-Match gets a 304.
+    """
+    await homepage.ensure_loaded()
+    index = category_index
+    if index is None:
         return {"message": "Failed to fetch categories from gjirafa50.com"}
+    if not q and min_subcategories is None and max_subcategories is None:
+        body, etag = index.responses[bool(include_empty_categories)]
+        if if_none_match and etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        return Response(content=body, media_type="application/json", headers={"ETag": etag})
+    return FastJSONResponse(index.filter(q, min_subcategories, max_subcategories, bool(include_empty_categories), search_subcategories))
 
 
 # Model for banner data
@@ -416,26 +2251,21 @@ class Banner(BaseModel):
     alt_text: str
     title: str
 
-# Function to scrape banners from gjirafa50.com
-def scrape_banners(url: str) -> List[Banner]:
-    response = requests.get(url)
-    if response.status_code == 200:
-        soup = BeautifulSoup(response.text, 'html.parser')
-        banner_elements = soup.find_all('div', class_='swiper-slide')
-        banners = []
-        for banner_element in banner_elements:
-            link_tag = banner_element.find('a')
-            img_tag = banner_element.find('img')
-            if link_tag and img_tag:
-                banner_link = link_tag.get('href')
-                img_src = img_tag.get('src')
-                img_alt = img_tag.get('alt')
-                img_title = img_tag.get('title')
-                banner = Banner(link=banner_link, image_url=img_src, alt_text=img_alt, title=img_title)
-                banners.append(banner)
-        return banners
-    else:
-        return []
+# Function to extract banners from the gjirafa50.com homepage
+def extract_banners(soup) -> List[dict]:
+    banner_elements = soup.find_all('div', class_='swiper-slide')
+    banners = []
+    for banner_element in banner_elements:
+        link_tag = banner_element.find('a')
+        img_tag = banner_element.find('img')
+        if link_tag and img_tag:
+            banners.append({
+                "link": link_tag.get('href'),
+                "image_url": img_tag.get('src'),
+                "alt_text": img_tag.get('alt'),
+                "title": img_tag.get('title'),
+            })
+    return banners
 
 
 @app.get("/api/banners", response_model=List[Banner], tags=["Banners"], dependencies=[Depends(authenticate_api_key)])
@@ -443,10 +2273,81 @@ async def get_banners():
     """
     Retrieve banners from gjirafa50.com.
     """
-    url = "https://gjirafa50.com"
-    return scrape_banners(url)
+    await homepage.ensure_loaded()
+    return homepage.banners
+
+
+def parse_homepage(content: bytes) -> Tuple[dict, List[dict]]:
+    """
+    Parses the homepage once into its categories and banners. Runs in the parse executor.
+    """
+    soup = parse_html(content, HOMEPAGE_STRAINER)
+    return extract_categories(soup), extract_banners(soup)
+
+
+class HomepageSnapshot:
+    """
+    Categories and banners parsed from a single fetch of the gjirafa50.com homepage.
+
+    The snapshot is refreshed in the background every `interval` seconds (or every
+    `retry_interval` seconds after a failure). A failed refresh keeps the last good
+    snapshot, so requests never wait on the homepage once it has been loaded.
+    """
+
+    def __init__(self, url: str = "https://gjirafa50.com",
+                 interval: float = HOMEPAGE_REFRESH_INTERVAL,
+                 retry_interval: float = HOMEPAGE_RETRY_INTERVAL):
+        self.url = url
+        self.interval = interval
+        self.retry_interval = retry_interval
+        self.categories: Optional[dict] = None
+        self.banners: List[Banner] = []
+        self.refreshed_at: Optional[float] = None
+        # Called with the snapshot after every successful refresh
+        self.listeners: List = []
 
+    @property
+    def loaded(self) -> bool:
+        return self.refreshed_at is not None
 
+    async def refresh(self) -> bool:
+        """Fetches and parses the homepage. Concurrent calls share one fetch."""
+        return await flights.do(("homepage", self.url), self._refresh)
+
+    async def _refresh(self) -> bool:
+        try:
+            response = await upstream.get(self.url)
+            if response.status_code != 200:
+                print(f"Failed to fetch the homepage. Status code: {response.status_code}")
+                return False
+            categories, banners = await run_parser(parse_homepage, response.content)
+        except Exception as e:
+            print(f"An error occurred: {str(e)}")
+            return False
+        self.categories = categories
+        self.banners = [Banner(**banner) for banner in banners]
+        self.refreshed_at = time.time()
+        for listener in self.listeners:
+            # A failing listener must not stop the background refresh or hide the new snapshot
+            try:
+                listener(self)
+            except Exception as e:
+                print(f"Homepage listener {getattr(listener, '__name__', listener)} failed: {str(e)}")
+        return True
+
+    async def ensure_loaded(self):
+        """Loads the snapshot if it has never been loaded, e.g. when a request arrives before startup finished."""
+        if not self.loaded:
+            await self.refresh()
+
+    async def run(self):
+        while True:
+            refreshed = await self.refresh()
+            await asyncio.sleep(self.interval if refreshed else self.retry_interval)
+
+
+homepage = HomepageSnapshot()
+homepage.listeners.append(rebuild_category_index)
 
 
 product_url = "https://gjirafa50.com/happy-hours"
@@ -455,27 +2356,22 @@ product_url = "https://gjirafa50.com/happy-hours"
 async def get_happy_hours():
     """
     Fetches and returns details of products on happy hours from gjirafa50.com.
+
+    The products are refreshed in the background every HAPPY_HOURS_POLL_INTERVAL seconds;
+    use /api/happy-hours/stream to be notified of changes instead of polling.
     """
-    transformed_products = fetch_and_transform_product_details(product_url)
+    # Served from the background poller's latest snapshot, fetched on demand only until it has one
+    transformed_products = happy_hours_feed.products
+    if transformed_products is None:
+        await happy_hours_feed.poll()
+        transformed_products = happy_hours_feed.products
     if transformed_products:
-        return {"products": transformed_products}
+        return FastJSONResponse({"products": transformed_products})
     else:
         return {"message": "Failed to fetch happy hour products."}
 
-def fetch_product_page(url):
-    response = requests.get(url)
-    if response.status_code == 200:
-        return response.text
-    else:
-        print(f"Failed to fetch the product page. Status code: {response.status_code}")
-        return None
-
-def extract_category_model(html_content):
-    category_model_pattern = re.compile(r"var categoryModel = (\{.*?\});", re.DOTALL)
-    category_model_match = category_model_pattern.search(html_content)
-    
-    if category_model_match:
-        category_model_json = category_model_match.group(1)
+def parse_category_model(category_model_json):
+    if category_model_json is not None:
         category_model_dict = json.loads(category_model_json)
         return category_model_dict
     else:
@@ -509,10 +2405,691 @@ def transform_product_details(products):
         print("No products found.")
         return []
 
-def fetch_and_transform_product_details(url):
-    html_content = fetch_product_page(url)
-    if html_content:
-        category_model = extract_category_model(html_content)
-        products = extract_products(category_model)
-        transformed_data = transform_product_details(products)
+async def fetch_and_transform_product_details(url):
+    # Only the categoryModel is needed, so the page is streamed until it has been read
+    status_code, category_model_json = await fetch_embedded_json(url, "categoryModel")
+    if status_code == 200:
+        transformed_data = await run_parser(transform_category_model, category_model_json)
+        for product in transformed_data:
+            price_history.record(product["SeName"], price=product["Price"], in_stock=product["InStock"],
+                                 stock_quantity=product["StockQuantity"])
         return transformed_data
+    else:
+        print(f"Failed to fetch the product page. Status code: {status_code}")
+
+def transform_category_model(category_model_json):
+    """
+    Parses the categoryModel JSON and transforms its products. Runs in the parse executor.
+    """
+    category_model = parse_category_model(category_model_json)
+    products = extract_products(category_model)
+    transformed_data = transform_product_details(products)
+    return transformed_data
+
+
+def diff_happy_hours(previous: List[dict], current: List[dict]) -> dict:
+    """Returns the products added, removed (by SeName) and changed between two happy hours snapshots."""
+    previous_by_key = {product["SeName"]: product for product in previous}
+    current_by_key = {product["SeName"]: product for product in current}
+    return {
+        "added": [product for key, product in current_by_key.items() if key not in previous_by_key],
+        "removed": [key for key in previous_by_key if key not in current_by_key],
+        "changed": [product for key, product in current_by_key.items()
+                    if key in previous_by_key and previous_by_key[key] != product],
+    }
+
+
+class HappyHoursFeed:
+    """
+    Polls the happy hours page once per interval for the whole process and pushes
+    the differences between successive snapshots to Server-Sent Events subscribers.
+    """
+
+    def __init__(self, url: str = product_url, interval: float = HAPPY_HOURS_POLL_INTERVAL):
+        self.url = url
+        self.interval = interval
+        self.products: Optional[List[dict]] = None
+        self.version = 0
+        self.subscribers: set = set()
+
+    async def poll(self) -> bool:
+        """Fetches the current products and notifies subscribers if anything changed."""
+        try:
+            products = await flights.do(("happy-hours", self.url), lambda: fetch_and_transform_product_details(self.url))
+        except Exception as e:
+            print(f"An error occurred: {str(e)}")
+            return False
+        if products is None:
+            # Keep the last snapshot when the page could not be fetched
+            return False
+        previous = self.products
+        self.products = products
+        if previous is None:
+            self.version += 1
+            self._publish(("snapshot", self.version, {"products": products}))
+            return True
+        diff = diff_happy_hours(previous, products)
+        if diff["added"] or diff["removed"] or diff["changed"]:
+            self.version += 1
+            self._publish(("diff", self.version, diff))
+        return True
+
+    def _publish(self, event: tuple):
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # The subscriber fell behind: drop what it has not read and resend the full snapshot
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(("snapshot", self.version, {"products": self.products}))
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=HAPPY_HOURS_SUBSCRIBER_QUEUE_SIZE)
+        if self.products is not None:
+            queue.put_nowait(("snapshot", self.version, {"products": self.products}))
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+
+    async def run(self):
+        while True:
+            await self.poll()
+            await asyncio.sleep(self.interval)
+
+
+happy_hours_feed = HappyHoursFeed()
+
+
+@app.get("/api/happy-hours/stream", tags=["Happy Hours"], dependencies=[Depends(authenticate_api_key)])
+async def stream_happy_hours():
+    """
+    Streams happy hours updates as Server-Sent Events.
+
+    The first event is a `snapshot` with all products. After that, a `diff` event with the
+    `added`, `removed` (SeName) and `changed` products is sent whenever the products change.
+    """
+    return StreamingResponse(happy_hours_events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+async def happy_hours_events():
+    queue = happy_hours_feed.subscribe()
+    try:
+        while True:
+            try:
+                event, version, data = await asyncio.wait_for(queue.get(), timeout=HAPPY_HOURS_HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                # Comment line keeping idle connections open through proxies
+                yield ": keep-alive\n\n"
+                continue
+            yield f"event: {event}\nid: {version}\ndata: {encode_json(data).decode('utf-8')}\n\n"
+    finally:
+        happy_hours_feed.unsubscribe(queue)
+
+# Local product catalog settings
+CATALOG_DB = os.getenv("CATALOG_DB", "catalog.db")
+CATALOG_CRAWL = os.getenv("CATALOG_CRAWL", "false").lower() in ("1", "true", "yes")
+CATALOG_CRAWL_INTERVAL = float(os.getenv("CATALOG_CRAWL_INTERVAL", "3600"))
+CATALOG_CRAWL_PAGES = int(os.getenv("CATALOG_CRAWL_PAGES", "5"))
+CATALOG_FULL_CRAWL_INTERVAL = float(os.getenv("CATALOG_FULL_CRAWL_INTERVAL", "86400"))
+CATALOG_CRAWL_CONCURRENCY = int(os.getenv("CATALOG_CRAWL_CONCURRENCY", "4"))
+CATALOG_DETAILS_MAX_AGE = float(os.getenv("CATALOG_DETAILS_MAX_AGE", "86400"))
+# Products not seen in a listing for this many seconds are treated as delisted (0 keeps them forever)
+CATALOG_MAX_AGE = float(os.getenv("CATALOG_MAX_AGE", "172800"))
+CATALOG_PAGE_SIZE = int(os.getenv("CATALOG_PAGE_SIZE", "24"))
+
+# Product details kept in the catalog (delivery times depend on the day they are requested, so they are not stored)
+CATALOG_DETAIL_FIELDS = tuple(field for field in PRODUCT_DETAIL_FIELDS if field != "DeliveryTimes")
+
+def product_path(url: str) -> str:
+    """Returns the path of a product URL or link, used as the product's key in the catalog."""
+    return urlsplit(url).path.rstrip("/") or "/"
+
+
+class CatalogStore:
+    """
+    SQLite store of the products seen by the catalog crawler.
+
+    Titles and specifications are indexed with FTS5 so /api/search and
+    /api/product/details can be answered in mode=local without contacting gjirafa50.com.
+
+    Reads use `connection` on the event loop. The crawler's writes run in a
+    thread on a separate `writer` connection, so with WAL they never block reads.
+
+    Products whose listing has not been seen for `max_age` seconds are left out
+    of reads, so delisted products and their old prices are not served.
+    """
+
+    def __init__(self, path: str = CATALOG_DB, max_age: float = CATALOG_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self._connection: Optional[sqlite3.Connection] = None
+        self._writer: Optional[sqlite3.Connection] = None
+        self._write_lock = threading.Lock()
+        self.last_crawl: Optional[float] = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = self._connect()
+        return self._connection
+
+    @property
+    def writer(self) -> sqlite3.Connection:
+        if self._writer is None:
+            self._writer = self._connect()
+        return self._writer
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript("""
+            CREATE TABLE IF NOT EXISTS products (
+                id INTEGER PRIMARY KEY,
+                path TEXT NOT NULL UNIQUE,
+                title TEXT NOT NULL,
+                price TEXT NOT NULL,
+                price_value REAL NOT NULL,
+                discount TEXT,
+                link TEXT NOT NULL,
+                price_no_discount TEXT NOT NULL,
+                image_url TEXT NOT NULL,
+                category TEXT,
+                in_stock INTEGER,
+                details TEXT,
+                first_seen REAL NOT NULL,
+                last_seen REAL NOT NULL,
+                details_updated REAL
+            );
+            CREATE INDEX IF NOT EXISTS products_price_value ON products (price_value);
+            CREATE INDEX IF NOT EXISTS products_first_seen ON products (first_seen);
+            CREATE INDEX IF NOT EXISTS products_last_seen ON products (last_seen);
+            CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+                title, specification, tokenize = 'unicode61 remove_diacritics 2'
+            );
+        """)
+        return connection
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+    @staticmethod
+    def _index(connection: sqlite3.Connection, product_id: int, title: str, specification: str):
+        connection.execute("DELETE FROM products_fts WHERE rowid = ?", (product_id,))
+        connection.execute("INSERT INTO products_fts (rowid, title, specification) VALUES (?, ?, ?)",
+                           (product_id, title, specification))
+
+    def upsert_listings(self, products: List[Product], category: Optional[str] = None) -> List[str]:
+        """Stores products from a listing page. Returns the paths of the products that were not in the catalog yet."""
+        now = time.time()
+        new_paths = []
+        with self._write_lock, self.writer as connection:
+            for product in products:
+                path = product_path(product.link)
+                row = connection.execute("SELECT id, details FROM products WHERE path = ?", (path,)).fetchone()
+                values = (product.title, product.price, product.price_value, product.discount, product.link,
+                          product.price_no_discount, product.image_url)
+                if row is None:
+                    cursor = connection.execute(
+                        "INSERT INTO products (path, title, price, price_value, discount, link, price_no_discount, image_url, category, first_seen, last_seen)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (path,) + values + (category, now, now))
+                    self._index(connection, cursor.lastrowid, product.title, "")
+                    new_paths.append(path)
+                else:
+                    connection.execute(
+                        "UPDATE products SET title = ?, price = ?, price_value = ?, discount = ?, link = ?, price_no_discount = ?, image_url = ?,"
+                        " category = COALESCE(category, ?), last_seen = ? WHERE id = ?", values + (category, now, row["id"]))
+                    if row["details"] is None:
+                        self._index(connection, row["id"], product.title, "")
+        return new_paths
+
+    def paths_needing_details(self, paths: List[str], max_age: float = CATALOG_DETAILS_MAX_AGE) -> List[str]:
+        if not paths:
+            return []
+        placeholders = ",".join("?" * len(paths))
+        with self._write_lock:
+            rows = self.writer.execute(
+                f"SELECT path FROM products WHERE path IN ({placeholders}) AND (details_updated IS NULL OR details_updated < ?)",
+                tuple(paths) + (time.time() - max_age,)).fetchall()
+        return [row["path"] for row in rows]
+
+    def save_details(self, path: str, details: dict):
+        specification = " ".join(f"{name} {value}" for name, value in details.get("ProductSpecificationModel", {}).items())
+        specification = f"{specification} {details.get('ShortDescription', '')}".strip()
+        with self._write_lock, self.writer as connection:
+            row = connection.execute("SELECT id, title FROM products WHERE path = ?", (path,)).fetchone()
+            if row is None:
+                return
+            connection.execute("UPDATE products SET details = ?, in_stock = ?, details_updated = ? WHERE id = ?",
+                               (json.dumps(details, ensure_ascii=False), int(bool(details.get("InStock"))), time.time(), row["id"]))
+            self._index(connection, row["id"], row["title"], specification)
+
+    def _seen_since(self) -> float:
+        return time.time() - self.max_age if self.max_age else 0.0
+
+    def get_details(self, path: str) -> Optional[dict]:
+        row = self.connection.execute("SELECT details FROM products WHERE path = ? AND last_seen >= ?",
+                                      (path, self._seen_since())).fetchone()
+        if row is None or row["details"] is None:
+            return None
+        return json.loads(row["details"])
+
+    def search(self, q: str, orderby: str, pagenumber: int, startprice: Optional[int] = None, maxprice: Optional[int] = None,
+               in_stock_only: bool = False, page_size: int = CATALOG_PAGE_SIZE, offset: int = 0) -> ScrapeResult:
+        """
+        Searches the catalog with the same parameters and result shape as scrape_website. `offset` skips that
+        many further products after the start of the page, for cursors that resume inside a page.
+        """
+        tokens = re.findall(r"\w+", q)
+        if not tokens:
+            return ScrapeResult(total_pages=0, views=0, products=[])
+        # Every token must match, as a prefix, the title or the specification
+        match = " ".join('"' + token.replace('"', '""') + '"*' for token in tokens)
+        conditions = ["products_fts MATCH ?", "products.last_seen >= ?"]
+        params: list = [match, self._seen_since()]
+        if startprice is not None and maxprice is not None:
+            conditions.append("products.price_value BETWEEN ? AND ?")
+            params += [startprice, maxprice]
+        if in_stock_only:
+            conditions.append("COALESCE(products.in_stock, 1) = 1")
+        where = " AND ".join(conditions)
+        order = {
+            "10": "products.price_value ASC",
+            "11": "products.price_value DESC",
+            "16": "products.first_seen DESC",
+            "17": "CAST(REPLACE(REPLACE(COALESCE(products.discount, '0'), '-', ''), '%', '') AS REAL) DESC",
+        }.get(orderby, "products_fts.rank")
+        query_from = "FROM products_fts JOIN products ON products.id = products_fts.rowid"
+        total = self.connection.execute(f"SELECT COUNT(*) {query_from} WHERE {where}", params).fetchone()[0]
+        rows = self.connection.execute(
+            f"SELECT products.* {query_from} WHERE {where} ORDER BY {order} LIMIT ? OFFSET ?",
+            params + [page_size, (pagenumber - 1) * page_size + offset]).fetchall()
+        products = [Product.model_construct(title=row["title"], price=row["price"], discount=row["discount"], link=row["link"],
+                            price_no_discount=row["price_no_discount"], image_url=row["image_url"],
+                            price_value=row["price_value"]) for row in rows]
+        return ScrapeResult(total_pages=(total + page_size - 1) // page_size, views=total, products=products)
+
+    def stats(self) -> dict:
+        row = self.connection.execute("SELECT COUNT(*), COUNT(details) FROM products").fetchone()
+        return {"products": row[0], "products_with_details": row[1], "last_crawl": self.last_crawl}
+
+
+catalog = CatalogStore()
+
+
+def parse_category_listing(category_model_json: str) -> Optional[Tuple[int, int, List[tuple]]]:
+    """
+    Parses the categoryModel of a category page into (total_pages, total_items, listing items), with the
+    items in the (title, price, discount, link, image_url) shape of parse_search_page. Runs in the parse executor.
+    """
+    category_model = parse_category_model(category_model_json)
+    products = extract_products(category_model)
+    if products is None:
+        return None
+    paging = category_model["CatalogProductsModel"]
+    items = []
+    for product in products:
+        discount = product["ProductPrice"].get("DiscountPercentage")
+        items.append((product["Name"], product["ProductPrice"]["Price"], f"-{discount}%" if discount and discount != "0" else None,
+                      "/" + product.get("SeName", ""), product["DefaultPictureModel"]["ImageUrl"]))
+    return paging.get("TotalPages", 0), paging.get("TotalItems", len(items)), items
+
+async def scrape_category(url: str, pagenumber: int, orderby: str = "16") -> Optional[ScrapeResult]:
+    """
+    Fetches one page of a category listing and returns it in the same shape as scrape_website.
+    """
+    status_code, category_model_json = await fetch_embedded_json(url, "categoryModel",
+                                                                 params={"orderby": orderby, "pagenumber": pagenumber})
+    if status_code != 200 or category_model_json is None:
+        return None
+    listing = await run_parser(parse_category_listing, category_model_json)
+    if listing is None:
+        return None
+    total_pages, total_items, items = listing
+    products = [Product.model_construct(title=title, price=price, discount=discount, link=link, price_no_discount=price,
+                                        image_url=image_url, price_value=get_price_value(price))
+                for title, price, discount, link, image_url in items]
+    return ScrapeResult.model_construct(total_pages=total_pages, views=total_items, products=products)
+
+
+class CatalogCrawler:
+    """
+    Keeps the local catalog up to date from gjirafa50.com.
+
+    Every round walks the listing of each subcategory URL from the homepage
+    newest first (orderby=16), storing the listings and the details of new or
+    outdated products with fetch_product_details. A subcategory stops at the
+    first page without new products, so after the first round only the newest
+    pages are fetched. Every `full_interval` seconds a round walks every page
+    instead, refreshing the price, stock and `last_seen` of older products.
+    Store writes run in a thread to keep the event loop free.
+    """
+
+    def __init__(self, store: CatalogStore, interval: float = CATALOG_CRAWL_INTERVAL, max_pages: int = CATALOG_CRAWL_PAGES,
+                 concurrency: int = CATALOG_CRAWL_CONCURRENCY, full_interval: float = CATALOG_FULL_CRAWL_INTERVAL):
+        self.store = store
+        self.interval = interval
+        self.max_pages = max_pages
+        self.concurrency = concurrency
+        self.full_interval = full_interval
+        self.last_full_crawl: Optional[float] = None
+
+    async def crawl_category(self, name: str, url: str, full: bool = False):
+        """Walks a subcategory listing. A full walk goes through every page instead of stopping early."""
+        url = urljoin("https://gjirafa50.com", url)
+        pagenumber = 1
+        while True:
+            page = await scrape_category(url, pagenumber, "16")
+            if not page or not page.products:
+                break
+            new_paths = await asyncio.to_thread(self.store.upsert_listings, page.products, name)
+            paths = [product_path(product.link) for product in page.products]
+            await self.crawl_details(await asyncio.to_thread(self.store.paths_needing_details, paths))
+            if page.total_pages and pagenumber >= page.total_pages:
+                break
+            # Only a full walk of a listing with paging information goes on past max_pages and known products
+            if not (full and page.total_pages) and (not new_paths or pagenumber >= self.max_pages):
+                break
+            pagenumber += 1
+
+    async def crawl_details(self, paths: List[str]):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def crawl_one(path: str):
+            async with semaphore:
+                try:
+                    details = await fetch_product_details(urljoin("https://gjirafa50.com", path), CATALOG_DETAIL_FIELDS)
+                except HTTPException as e:
+                    print(f"Failed to fetch details for {path}: {e.detail}")
+                    return
+                await asyncio.to_thread(self.store.save_details, path, details)
+
+        await asyncio.gather(*(crawl_one(path) for path in paths))
+
+    async def crawl(self):
+        await homepage.ensure_loaded()
+        started = time.time()
+        full = self.last_full_crawl is None or started - self.last_full_crawl >= self.full_interval
+        for subcategories in (homepage.categories or {}).values():
+            for subcategory in subcategories:
+                try:
+                    await self.crawl_category(subcategory["name"], subcategory["url"], full)
+                except Exception as e:
+                    print(f"Failed to crawl category {subcategory['name']}: {str(e)}")
+        if full:
+            self.last_full_crawl = started
+        self.store.last_crawl = time.time()
+
+    async def run(self):
+        while True:
+            await self.crawl()
+            await asyncio.sleep(self.interval)
+
+
+catalog_crawler = CatalogCrawler(catalog)
+
+
+@app.get("/api/catalog/stats", tags=["Catalog"], dependencies=[Depends(authenticate_api_key)])
+async def get_catalog_stats():
+    """
+    Returns the number of products in the local catalog and when the last crawl finished.
+    """
+    return catalog.stats()
+
+
+# Price and stock history settings
+HISTORY_FILE = os.getenv("HISTORY_FILE", "")
+HISTORY_SAVE_INTERVAL = float(os.getenv("HISTORY_SAVE_INTERVAL", "300"))
+# Products copied between yields to the event loop while the history is snapshotted for saving
+HISTORY_SNAPSHOT_CHUNK = 2000
+
+# Marker for a missing string or in-stock value in the history arrays
+HISTORY_UNKNOWN = -1
+
+
+class ProductHistory:
+    """Observations of one product, stored as parallel arrays holding only the points where something changed."""
+
+    __slots__ = ("timestamps", "price_ids", "price_with_discount_ids", "in_stock", "stock_quantity", "last_seen")
+
+    def __init__(self):
+        self.timestamps = array("d")
+        self.price_ids = array("i")
+        self.price_with_discount_ids = array("i")
+        self.in_stock = array("b")
+        self.stock_quantity = array("q")
+        self.last_seen = 0.0
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def state(self, index: int = -1) -> tuple:
+        return (self.price_ids[index], self.price_with_discount_ids[index], self.in_stock[index], self.stock_quantity[index])
+
+    def __getstate__(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    def copy(self) -> "ProductHistory":
+        history = ProductHistory.__new__(ProductHistory)
+        for slot in self.__slots__:
+            value = getattr(self, slot)
+            setattr(history, slot, value[:] if isinstance(value, array) else value)
+        return history
+
+    def __setstate__(self, state):
+        for slot, value in state.items():
+            setattr(self, slot, value)
+
+
+class PriceHistory:
+    """
+    Append-only price and stock observations per product, keyed by product path (SeName).
+
+    An observation that repeats the previous state only moves `last_seen`, so a product
+    costs a few bytes per actual change. Price strings are interned once for all products.
+    Every change is also appended to a global log ordered by time, which /api/changes
+    reads with a binary search.
+    """
+
+    def __init__(self):
+        self.products: Dict[str, ProductHistory] = {}
+        self.strings: List[str] = []
+        self.string_ids: Dict[str, int] = {}
+        self.keys: List[str] = []
+        self.key_ids: Dict[str, int] = {}
+        self.change_times = array("d")
+        self.change_key_ids = array("i")
+        # Keys recorded while a snapshot is being taken, None when no snapshot is running
+        self._modified: Optional[set] = None
+
+    def _intern(self, value: Optional[str]) -> int:
+        if value is None:
+            return HISTORY_UNKNOWN
+        string_id = self.string_ids.get(value)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.strings.append(value)
+            self.string_ids[value] = string_id
+        return string_id
+
+    def _string(self, string_id: int) -> Optional[str]:
+        return None if string_id == HISTORY_UNKNOWN else self.strings[string_id]
+
+    def record(self, key: str, price: Optional[str] = None, price_with_discount: Optional[str] = None,
+               in_stock: Optional[bool] = None, stock_quantity: Optional[int] = None, timestamp: Optional[float] = None) -> bool:
+        """
+        Records an observation. Values that were not observed (None) keep their previous value,
+        and values observed for the first time fill in the current state instead of counting as a change.
+        Returns True if the price or stock changed.
+        """
+        if price is None and price_with_discount is None and in_stock is None and stock_quantity is None:
+            # Nothing about the price or stock was observed, e.g. a fields=Name projection
+            return False
+        timestamp = timestamp if timestamp is not None else time.time()
+        history = self.products.get(key)
+        if history is None:
+            history = self.products[key] = ProductHistory()
+            self.key_ids[key] = len(self.keys)
+            self.keys.append(key)
+        previous = history.state() if len(history) else (HISTORY_UNKNOWN, HISTORY_UNKNOWN, HISTORY_UNKNOWN, HISTORY_UNKNOWN)
+        state = (
+            self._intern(price) if price is not None else previous[0],
+            self._intern(price_with_discount) if price_with_discount is not None else previous[1],
+            int(bool(in_stock)) if in_stock is not None else previous[2],
+            int(stock_quantity) if stock_quantity is not None else previous[3],
+        )
+        history.last_seen = timestamp
+        if self._modified is not None:
+            self._modified.add(key)
+        if len(history) and state == previous:
+            return False
+        if len(history) and all(old == HISTORY_UNKNOWN or old == new for old, new in zip(previous, state)):
+            # Only values that were unknown until now were observed
+            history.price_ids[-1], history.price_with_discount_ids[-1], history.in_stock[-1], history.stock_quantity[-1] = state
+            return False
+        history.timestamps.append(timestamp)
+        history.price_ids.append(state[0])
+        history.price_with_discount_ids.append(state[1])
+        history.in_stock.append(state[2])
+        history.stock_quantity.append(state[3])
+        if len(history) == 1:
+            # The first observation of a product is not a change
+            return False
+        self.change_times.append(timestamp)
+        self.change_key_ids.append(self.key_ids[key])
+        return True
+
+    def record_details(self, key: str, details: dict) -> bool:
+        return self.record(key, price=details.get("Price"), price_with_discount=details.get("PriceWithDiscount"),
+                           in_stock=details.get("InStock"), stock_quantity=details.get("StockQuantity"))
+
+    def _observation(self, history: ProductHistory, index: int) -> dict:
+        price_id, price_with_discount_id, in_stock, stock_quantity = history.state(index)
+        return {
+            "Timestamp": history.timestamps[index],
+            "Price": self._string(price_id),
+            "PriceWithDiscount": self._string(price_with_discount_id),
+            "InStock": None if in_stock == HISTORY_UNKNOWN else bool(in_stock),
+            "StockQuantity": None if stock_quantity == HISTORY_UNKNOWN else stock_quantity,
+        }
+
+    def history(self, key: str) -> Optional[dict]:
+        history = self.products.get(key)
+        if history is None:
+            return None
+        return {
+            "Key": key,
+            "LastSeen": history.last_seen,
+            "Observations": [self._observation(history, index) for index in range(len(history))],
+        }
+
+    def changes(self, since: float) -> List[dict]:
+        """Returns the current and previous state of every product whose price or stock changed after `since`."""
+        start = bisect.bisect_right(self.change_times, since)
+        changed_key_ids = dict.fromkeys(self.change_key_ids[start:])
+        changes = []
+        for key_id in changed_key_ids:
+            key = self.keys[key_id]
+            history = self.products[key]
+            # The last state recorded at or before `since` is what the client saw before
+            previous_index = bisect.bisect_right(history.timestamps, since) - 1
+            changes.append({
+                "Key": key,
+                "Current": self._observation(history, len(history) - 1),
+                "Previous": self._observation(history, previous_index) if previous_index >= 0 else None,
+            })
+        return changes
+
+    def save(self, path: str):
+        self._write(path, {"products": self.products, "strings": self.strings, "keys": self.keys,
+                           "change_times": self.change_times, "change_key_ids": self.change_key_ids})
+
+    async def snapshot(self, chunk_size: int = HISTORY_SNAPSHOT_CHUNK) -> dict:
+        """
+        Copies the state to save, so it can be pickled in a thread while the event loop keeps recording.
+
+        Products are copied in chunks, yielding to the event loop in between, and the products recorded
+        meanwhile are copied again at the end, so the result is the state at the moment it is returned.
+        """
+        self._modified = set()
+        try:
+            products = {}
+            index = 0
+            while index < len(self.keys):
+                for key in self.keys[index:index + chunk_size]:
+                    products[key] = self.products[key].copy()
+                index += chunk_size
+                await asyncio.sleep(0)
+            for key in self._modified:
+                products[key] = self.products[key].copy()
+        finally:
+            self._modified = None
+        # Interned strings and keys are only ever appended, so a shallow copy of the lists is enough
+        return {"products": products, "strings": list(self.strings), "keys": list(self.keys),
+                "change_times": self.change_times[:], "change_key_ids": self.change_key_ids[:]}
+
+    @staticmethod
+    def _write(path: str, state: dict):
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "wb") as file:
+            pickler = pickle.Pickler(file)
+            # Nothing in the history is shared or recursive, and without the memo the pickler does not hold
+            # the GIL for the rehashes of a memo with millions of entries, which would stall the event loop
+            pickler.fast = True
+            pickler.dump(state)
+        os.replace(temporary_path, path)
+
+    def load(self, path: str):
+        with open(path, "rb") as file:
+            state = pickle.load(file)
+        self.products = state["products"]
+        self.strings = state["strings"]
+        self.string_ids = {string: string_id for string_id, string in enumerate(self.strings)}
+        self.keys = state["keys"]
+        self.key_ids = {key: key_id for key_id, key in enumerate(self.keys)}
+        self.change_times = state["change_times"]
+        self.change_key_ids = state["change_key_ids"]
+
+    async def save_periodically(self, path: str, interval: float = HISTORY_SAVE_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self._write, path, await self.snapshot())
+            except OSError as e:
+                print(f"Failed to save the price history: {str(e)}")
+
+
+price_history = PriceHistory()
+
+
+@app.get("/api/product/history", tags=["Product Details"], dependencies=[Depends(authenticate_api_key)])
+async def get_product_history(product_url: str = Query(..., description="Product URL or SeName, e.g. /product-name")):
+    """
+    Returns the recorded price and stock observations of a product.
+
+    An observation is only recorded when the price or stock changed; LastSeen is the last
+    time the product was observed at all.
+    """
+    history = price_history.history(product_path(product_url))
+    if history is None:
+        raise HTTPException(status_code=404, detail="No history recorded for this product.")
+    return history
+
+@app.get("/api/changes", tags=["Product Details"], dependencies=[Depends(authenticate_api_key)])
+async def get_changes(since: float = Query(..., description="Unix timestamp; only changes after it are returned")):
+    """
+    Returns the products whose price or stock changed after `since`, with their current and previous state.
+
+    Use the returned `until` as `since` in the next poll.
+    """
+    until = time.time()
+    return {"since": since, "until": until, "changes": price_history.changes(since)}
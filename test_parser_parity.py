@@ -0,0 +1,148 @@
+"""
+Parity tests for the HTML parser backends.
+
+Every extraction must return exactly what the original code returned: the whole
+document parsed with html.parser and no SoupStrainer. The streaming scanner for
+embedded JSON must find the same object in a page fed in chunks as in the whole
+page. Run with `python -m pytest`.
+"""
+import json
+import os
+
+import pytest
+from bs4 import BeautifulSoup
+
+import mainapi
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+PARSERS = ["html.parser", pytest.param("lxml", marks=pytest.mark.skipif(mainapi.lxml_html is None, reason="lxml is not installed"))]
+
+SEARCH_EDGE_HTML = """
+<div class="products">
+  <div class="item-box">
+    <a href="/laptop-asus?x=1&amp;y=2"><img src="/img/a&amp;b.jpg"/></a>
+    <h2 class="product-title">  Laptop ASUS &amp; Co, 15.6&quot; &eacute;cran<br>Intel&nbsp;i7 </h2>
+    <span class="price">1,299.50&#160;&euro;</span>
+    <div class="discount__label"> -10% </div>
+  </div>
+  <div class="product-item item-box   grid-item" data-id="2">
+    <a href="/monitor"><img src="/img/m.jpg" alt="m"></a>
+    <h2 class="title product-title text-sm"><a href="/monitor">Monitor <b>Dell</b><br/>27"</a></h2>
+    <span class="old-price">400.00 €</span><span class="price font-bold">349.00 €</span>
+  </div>
+  <div class="item-boxes"><h2 class="product-title">Not an item box</h2></div>
+  <div class="item-box">
+    <a href="/kufje"><img src="/img/k.jpg"></a>
+    <h2 class="product-title">Kufje Kosovë</h2>
+    <span class="price">19.90 €</span>
+    <div class="discount__label extra">-5%</div>
+  </div>
+</div>
+"""
+
+# Pages without any element, such as the "no results" fragment
+SEARCH_EMPTY_HTML = ["", "  \n ", "<!-- no results -->", "\n<!-- Nuk u gjet asnjë produkt -->\n"]
+
+HOMEPAGE_EDGE_HTML = """
+<html><body>
+<ul>
+  <li class="category-item"><a class="category-item-content" href="/laptope">Laptop&euml; &amp; Tablet&euml;</a>
+    <ul class="sublist"><li><a class="category-item-content" href="/gaming">Gaming<br>Laptop</a></li>
+    <li><a class="category-item-content link" href="/biznes">Biznes</a></li></ul></li>
+  <li class="group category-item relative"><a class="flex category-item-content" href="/telefona"> Telefona </a></li>
+  <li class="category-item"><a class="category-item-content" href="/foto">Foto &amp; Kamer&euml;</a><ul class="sublist"></ul></li>
+</ul>
+<div class="swiper-slide"><a href="/promo?a=1&amp;b=2"><img src="/b1.jpg" alt="Oferta &amp; zbritje" title="Banner 1"></a></div>
+<div class="swiper-slide swiper-slide-active"><a href="/promo2"><img src="/b2.jpg"></a></div>
+<div class="swiper-slide"><img src="/no-link.jpg"></div>
+</body></html>
+"""
+
+DELIVERY_EDGE_HTML = """
+<div class="flex flex-col justify-center pl-2 text-xs font-medium pr-2 mr-2 tablet:border-r">Prishtin&euml;<br><span>12 Mars 2024 - 14 Mars 2024</span></div>
+<div class="flex flex-col justify-center pl-2 text-xs font-medium">Kosov&euml;, t&euml; tjera <span>13&nbsp;Mars 2024 - 16 Mars 2024</span></div>
+"""
+
+
+def read_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES_DIR, name), encoding="utf-8") as file:
+        return file.read()
+
+
+def original_search_items(html_content: str) -> list:
+    soup = BeautifulSoup(html_content, "html.parser")
+    items = []
+    for item_box in soup.find_all("div", class_="item-box"):
+        product_title = item_box.find("h2", class_="product-title").text.strip()
+        price = item_box.find("span", class_="price").text.strip()
+        discount_label = item_box.find("div", class_="discount__label")
+        discount = discount_label.text.strip() if discount_label else None
+        product_link = item_box.find("a")["href"]
+        image_url = item_box.find("img")["src"]
+        items.append((product_title, price, discount, product_link, image_url))
+    return items
+
+
+def search_pages() -> list:
+    return [json.loads(read_fixture("search.json"))["html"], SEARCH_EDGE_HTML] + SEARCH_EMPTY_HTML
+
+
+SEARCH_PAGE_IDS = ["fixture", "edge", "empty", "whitespace", "comment", "comment-text"]
+
+
+@pytest.mark.parametrize("html_content", search_pages(), ids=SEARCH_PAGE_IDS)
+def test_search_items_soup_matches_original(html_content):
+    assert mainapi.extract_search_items_soup(html_content) == original_search_items(html_content)
+
+
+@pytest.mark.skipif(mainapi.lxml_html is None, reason="lxml is not installed")
+@pytest.mark.parametrize("html_content", search_pages(), ids=SEARCH_PAGE_IDS)
+def test_search_items_lxml_matches_original(html_content):
+    assert mainapi.extract_search_items_lxml(html_content) == original_search_items(html_content)
+
+
+def test_search_edge_markup_is_covered():
+    items = original_search_items(SEARCH_EDGE_HTML)
+    assert len(items) == 3
+    assert items[1][2] is None
+
+
+@pytest.mark.parametrize("parser", PARSERS)
+@pytest.mark.parametrize("name", ["homepage.html", "edge"])
+def test_parse_homepage_matches_original(monkeypatch, parser, name):
+    monkeypatch.setattr(mainapi, "HTML_PARSER", parser)
+    content = HOMEPAGE_EDGE_HTML if name == "edge" else read_fixture(name)
+    soup = BeautifulSoup(content, "html.parser")
+    expected = (mainapi.extract_categories(soup), mainapi.extract_banners(soup))
+    assert mainapi.parse_homepage(content.encode("utf-8")) == expected
+
+
+@pytest.mark.parametrize("parser", PARSERS)
+@pytest.mark.parametrize("name", ["product.html", "edge"])
+def test_extract_delivery_times_matches_original(parser, name):
+    html_content = DELIVERY_EDGE_HTML if name == "edge" else read_fixture(name)
+    expected = mainapi.extract_delivery_times(BeautifulSoup(html_content, "html.parser"))
+    assert expected
+    soup = mainapi.parse_html(html_content, mainapi.DELIVERY_TIMES_STRAINER, parser=parser)
+    assert mainapi.extract_delivery_times(soup) == expected
+
+
+EMBEDDED_JSON_PAGES = [
+    'var productModel = {"Name": "a };", "Nested": {"x": [1, 2]}};',
+    "<script>var productModel" + " " * 50 + '= {"Name": "spaces"};</script>',
+    'var other = {}; var\n\n   productModel \n =\n  {"Name": "newlines"}; var productModel = {"Name": "second"};',
+    'var productModelX = {"Name": "wrong"}; vvar productModel={"Name": "right"}',
+]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 17, 4096])
+@pytest.mark.parametrize("page", EMBEDDED_JSON_PAGES + [read_fixture("product.html")], ids=["escapes", "spaces", "newlines", "prefix", "fixture"])
+def test_embedded_json_chunks_match_whole_page(page, chunk_size):
+    expected = mainapi.find_embedded_json(page, "productModel")
+    assert expected is not None
+    scanner = mainapi.EmbeddedJSONScanner("productModel")
+    for start in range(0, len(page), chunk_size):
+        if scanner.feed(page[start:start + chunk_size]):
+            break
+    assert scanner.result == expected